@@ -0,0 +1,276 @@
+# coding=utf-8
+#
+# Local stand-in for signal-cli-rest-api and a webcam, for benchmarking only.
+#
+# Emulates /v1/about, /v2/send, /v1/typing-indicator, /v1/groups and /v1/receive (long polling in normal
+# mode, a websocket in json-rpc mode) with injectable latency and failures, plus a snapshot url and an
+# MJPEG stream. Only the standard library is used so it runs wherever the plugin does.
+from __future__ import absolute_import, print_function
+
+import base64
+import collections
+import hashlib
+import json
+import random
+import re
+import socket
+import struct
+import threading
+import time
+
+try:
+    from http.server import BaseHTTPRequestHandler, HTTPServer
+    from socketserver import ThreadingMixIn
+    from urllib.parse import urlparse, parse_qs
+except ImportError:
+    from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+    from SocketServer import ThreadingMixIn
+    from urlparse import urlparse, parse_qs
+
+WEBSOCKET_GUID = "258EAFA5-E914-47DA-95CA-C5AB0DC85B11"
+
+class FakeSignalState(object):
+    def __init__(self, mode="normal", latency=0.0, jitter=0.0, failure_rate=0.0, rate_limit_rate=0.0, frame_size=64 * 1024):
+        self.mode = mode
+        self.latency = latency
+        self.jitter = jitter
+        self.failure_rate = failure_rate
+        self.rate_limit_rate = rate_limit_rate
+
+        self.lock = threading.Lock()
+        self.inbound = collections.deque()
+        self.inbound_ready = threading.Condition(self.lock)
+        self.sent = []
+        self.sent_ready = threading.Condition(self.lock)
+        self.requests = collections.Counter()
+        self.groups = {}
+
+        # only the JPEG start/end markers are real: enough for the snapshot path and the MJPEG parser, not for ffmpeg
+        self.frame = b"\xff\xd8" + b"\x00" * max(0, frame_size - 4) + b"\xff\xd9"
+
+    def delay(self):
+        if self.latency or self.jitter:
+            time.sleep(max(0, self.latency + random.uniform(-self.jitter, self.jitter)))
+
+    def push_inbound(self, message, source, group_id=None):
+        data_message = {"message": message, "timestamp": int(time.time() * 1000)}
+        if group_id:
+            data_message["groupInfo"] = {"groupId": group_id}
+        envelope = {"envelope": {"source": source, "sourceNumber": source, "timestamp": time.time(), "dataMessage": data_message}}
+        with self.lock:
+            self.inbound.append(envelope)
+            self.inbound_ready.notify_all()
+
+    def take_inbound(self, wait):
+        deadline = time.time() + wait
+        with self.lock:
+            while not self.inbound and time.time() < deadline:
+                self.inbound_ready.wait(deadline - time.time())
+            messages = list(self.inbound)
+            self.inbound.clear()
+            return messages
+
+    def record_sent(self, body):
+        with self.lock:
+            self.sent.append((time.time(), body))
+            self.sent_ready.notify_all()
+
+    def wait_sent(self, count, timeout):
+        deadline = time.time() + timeout
+        with self.lock:
+            while len(self.sent) < count and time.time() < deadline:
+                self.sent_ready.wait(deadline - time.time())
+            return len(self.sent)
+
+class FakeSignalHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    state = None
+
+    def log_message(self, *args):
+        pass
+
+    def _body(self):
+        length = int(self.headers.get("Content-Length") or 0)
+        return self.rfile.read(length) if length else b""
+
+    def _reply(self, status, data=None, content_type="application/json"):
+        payload = b"" if data is None else (data if isinstance(data, bytes) else json.dumps(data).encode("utf-8"))
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def _count(self, name):
+        with self.state.lock:
+            self.state.requests[name] += 1
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        if url.path == "/v1/about":
+            self._count("about")
+            return self._reply(200, {"versions": ["v1", "v2"], "build": 2, "mode": self.state.mode, "version": "fake"})
+        if url.path.startswith("/v1/receive/"):
+            self._count("receive")
+            if self.headers.get("Upgrade", "").lower() == "websocket":
+                return self._websocket_receive()
+            wait = float(parse_qs(url.query).get("timeout", ["0"])[0])
+            return self._reply(200, self.state.take_inbound(wait))
+        if url.path.startswith("/v1/groups/"):
+            self._count("list_groups")
+            self.state.delay()
+            with self.state.lock:
+                groups = [{"id": group_id, "internal_id": internal_id, "name": "bench"} for group_id, internal_id in self.state.groups.items()]
+            return self._reply(200, groups)
+        if url.path == "/webcam/snapshot":
+            self._count("snapshot")
+            return self._reply(200, self.state.frame, "image/jpeg")
+        if url.path == "/webcam/stream":
+            self._count("stream")
+            return self._mjpeg(float(parse_qs(url.query).get("fps", ["15"])[0]))
+        self._reply(404, {"error": "not found"})
+
+    def do_POST(self):
+        url = urlparse(self.path)
+        body = self._body()
+        if url.path in ("/v2/send", "/v1/send"):
+            self._count("send")
+            self.state.delay()
+            roll = random.random()
+            if roll < self.state.rate_limit_rate:
+                return self._reply(400, {"error": "Failed to send message: [413] Rate limit exceeded"})
+            if roll < self.state.rate_limit_rate + self.state.failure_rate:
+                return self._reply(400, {"error": "Failed to send message: injected failure"})
+            self.state.record_sent(json.loads(body.decode("utf-8")))
+            return self._reply(201, {"timestamp": str(int(time.time() * 1000))})
+        if url.path.startswith("/v1/groups/"):
+            self._count("create_group")
+            self.state.delay()
+            internal_id = base64.b64encode(("bench-%d" % random.getrandbits(64)).encode("ascii")).decode("ascii")
+            group_id = "group." + base64.b64encode(internal_id.encode("ascii")).decode("ascii")
+            with self.state.lock:
+                self.state.groups[group_id] = internal_id
+            return self._reply(201, {"id": group_id})
+        self._reply(404, {"error": "not found"})
+
+    def do_PUT(self):
+        self._body()
+        if self.path.startswith("/v1/typing-indicator/"):
+            self._count("typing")
+            self.state.delay()
+            return self._reply(204)
+        self._reply(404, {"error": "not found"})
+
+    do_DELETE = do_PUT
+
+    def _mjpeg(self, fps):
+        self.send_response(200)
+        self.send_header("Content-Type", "multipart/x-mixed-replace; boundary=frame")
+        self.send_header("Connection", "close")
+        self.end_headers()
+        self.close_connection = True
+        try:
+            while True:
+                frame = self.state.frame
+                self.wfile.write(b"--frame\r\nContent-Type: image/jpeg\r\nContent-Length: " + str(len(frame)).encode("ascii") + b"\r\n\r\n" + frame + b"\r\n")
+                self.wfile.flush()
+                time.sleep(1.0 / fps)
+        except (socket.error, IOError):
+            pass
+
+    def _websocket_receive(self):
+        key = self.headers.get("Sec-WebSocket-Key", "")
+        accept = base64.b64encode(hashlib.sha1((key + WEBSOCKET_GUID).encode("ascii")).digest()).decode("ascii")
+        self.send_response(101)
+        self.send_header("Upgrade", "websocket")
+        self.send_header("Connection", "Upgrade")
+        self.send_header("Sec-WebSocket-Accept", accept)
+        self.end_headers()
+        self.close_connection = True
+
+        sock = self.connection
+        closed = threading.Event()
+        write_lock = threading.Lock()
+
+        def send_frame(opcode, payload):
+            header = struct.pack("!B", 0x80 | opcode)
+            if len(payload) < 126:
+                header += struct.pack("!B", len(payload))
+            elif len(payload) < 65536:
+                header += struct.pack("!BH", 126, len(payload))
+            else:
+                header += struct.pack("!BQ", 127, len(payload))
+            with write_lock:
+                sock.sendall(header + payload)
+
+        # answer pings and notice the client going away
+        def read_frames():
+            try:
+                while not closed.is_set():
+                    head = self.rfile.read(2)
+                    if len(head) < 2:
+                        break
+                    opcode, length = head[0] & 0x0f, head[1] & 0x7f
+                    if length == 126:
+                        length = struct.unpack("!H", self.rfile.read(2))[0]
+                    elif length == 127:
+                        length = struct.unpack("!Q", self.rfile.read(8))[0]
+                    mask = self.rfile.read(4) if head[1] & 0x80 else b"\x00" * 4
+                    payload = bytearray(self.rfile.read(length))
+                    for i in range(len(payload)):
+                        payload[i] ^= mask[i % 4]
+                    if opcode == 0x9:
+                        send_frame(0xA, bytes(payload))
+                    elif opcode == 0x8:
+                        break
+            except (socket.error, IOError, ValueError):
+                pass
+            closed.set()
+
+        reader = threading.Thread(target=read_frames)
+        reader.daemon = True
+        reader.start()
+
+        try:
+            while not closed.is_set():
+                for envelope in self.state.take_inbound(0.5):
+                    send_frame(0x1, json.dumps(envelope).encode("utf-8"))
+        except (socket.error, IOError):
+            pass
+        closed.set()
+
+class ThreadingServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+class FakeSignalServer(object):
+    def __init__(self, state=None, host="127.0.0.1", port=0):
+        self.state = state or FakeSignalState()
+        handler = type("BoundFakeSignalHandler", (FakeSignalHandler,), {"state": self.state})
+        self._server = ThreadingServer((host, port), handler)
+        self._thread = threading.Thread(target=self._server.serve_forever)
+        self._thread.daemon = True
+
+    @property
+    def url(self):
+        host, port = self._server.server_address[:2]
+        return "http://{}:{}".format(host, port)
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+# correlates what arrived at the fake server with what the benchmark submitted
+def sent_markers(state, pattern=r"bench-(\d+)"):
+    regex = re.compile(pattern)
+    with state.lock:
+        sent = list(state.sent)
+    markers = {}
+    for received, body in sent:
+        for match in regex.finditer(body.get("message", "")):
+            markers.setdefault(int(match.group(1)), received)
+    return markers
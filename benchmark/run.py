@@ -0,0 +1,372 @@
+# coding=utf-8
+#
+# Throughput and latency benchmark of the plugin against the local fake signal-cli-rest-api.
+#
+# Needs OctoPrint and the plugin requirements installed (run it from the OctoPrint virtualenv), but
+# neither a Signal account nor a printer or a webcam:
+#
+#     python benchmark/run.py --scenario all -n 500 --latency 0.05 --concurrency 8
+#
+# Scenarios:
+#   send      defer_send_message called directly from --concurrency threads
+#   events    a storm of PRINT_DONE events through on_event, coalescer and send queue
+#   progress  a storm of on_print_progress ticks
+#   inbound   a flood of inbound "gcode" commands through the ReceiveThread
+#   shutdown  how long Events.SHUTDOWN takes with every receive thread connected (-n times, try --mode json-rpc)
+from __future__ import absolute_import, print_function
+
+import argparse
+import json
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import logging
+
+from octoprint.events import Events
+
+import octoprint_signalclirestapi
+from fake_signal import FakeSignalServer, FakeSignalState, sent_markers
+
+SENDER = "+10000000000"
+RECIPIENT = "+10000000001"
+
+class FakeSettings(object):
+    def __init__(self, defaults, overrides, global_settings):
+        self._values = dict(defaults)
+        self._values.update(overrides)
+        self._global = global_settings
+        self.overrides = overrides
+
+    def get(self, path, **kwargs):
+        return self._values.get(path[0])
+
+    def get_boolean(self, path, **kwargs):
+        value = self._values.get(path[0])
+        if isinstance(value, str):
+            return value.lower() in ("true", "yes", "1")
+        return bool(value)
+
+    def get_int(self, path, **kwargs):
+        return int(self._values.get(path[0]))
+
+    def set(self, path, value, **kwargs):
+        self._values[path[0]] = value
+
+    def remove(self, path, **kwargs):
+        self._values.pop(path[0], None)
+
+    def save(self, *args, **kwargs):
+        pass
+
+    def global_get(self, path, **kwargs):
+        return self._global.get(tuple(path))
+
+class FakePrinter(object):
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.commands_seen = []
+        self.callbacks = []
+
+    def commands(self, commands, **kwargs):
+        with self.lock:
+            self.commands_seen.append((time.time(), commands))
+
+    def register_callback(self, callback):
+        self.callbacks.append(callback)
+
+    # like OctoPrint's, unregistering twice is not an error
+    def unregister_callback(self, callback):
+        if callback in self.callbacks:
+            self.callbacks.remove(callback)
+
+    def get_state_string(self):
+        return "Operational"
+
+    def get_current_temperatures(self):
+        return {"tool0": {"actual": 210.0, "target": 210.0}, "bed": {"actual": 60.0, "target": 60.0}}
+
+    def get_current_data(self):
+        return {"state": {"text": "Operational"}, "progress": {"completion": None}, "job": {"file": {"name": None}}}
+
+    def is_printing(self):
+        return False
+
+    def is_paused(self):
+        return False
+
+    def is_pausing(self):
+        return False
+
+    def __getattr__(self, name):
+        # pause_print, connect, set_temperature and friends
+        return lambda *args, **kwargs: None
+
+class FakePluginManager(object):
+    def get_hooks(self, hook):
+        return {}
+
+class FakeProfileManager(object):
+    def get_current_or_default(self):
+        return {"name": "bench", "id": "_default"}
+
+class Sampler(threading.Thread):
+    def __init__(self, interval=0.05):
+        super(Sampler, self).__init__(name="benchmark-sampler")
+        self.daemon = True
+        self.interval = interval
+        self.peak_threads = 0
+        self.peak_rss = 0
+        self._stop_event = threading.Event()
+
+    def run(self):
+        while not self._stop_event.is_set():
+            self.sample()
+            self._stop_event.wait(self.interval)
+
+    def sample(self):
+        self.peak_threads = max(self.peak_threads, threading.active_count())
+        self.peak_rss = max(self.peak_rss, rss_bytes())
+
+    def stop(self):
+        self._stop_event.set()
+        self.sample()
+
+def rss_bytes():
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) * 1024
+    except IOError:
+        pass
+    try:
+        import resource
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+    except ImportError:
+        return 0
+
+def percentile(values, q):
+    if not values:
+        return None
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(q * (len(values) - 1))))]
+
+def make_plugin(server, args, data_folder, overrides):
+    plugin = octoprint_signalclirestapi.SignalclirestapiPlugin()
+    plugin._logger = logging.getLogger("benchmark.plugin")
+    plugin._identifier = "signalclirestapi"
+    plugin._printer = FakePrinter()
+    plugin._plugin_manager = FakePluginManager()
+    plugin._printer_profile_manager = FakeProfileManager()
+    plugin.get_plugin_data_folder = lambda: data_folder
+
+    settings = dict(
+        enabled=True,
+        url=server.url,
+        sendernr=SENDER,
+        recipientnrs=RECIPIENT,
+        groupsettings="none",
+        attachsnapshots=args.snapshots,
+        snapshotasgif=False,
+        progressintervals=",".join(str(p) for p in range(1, 101)),
+        framebufferenabled=args.frame_buffer,
+        ratelimitenabled=args.rate_limit
+    )
+    settings.update(overrides)
+
+    webcam = {
+        ("webcam", "snapshot"): server.url + "/webcam/snapshot",
+        ("webcam", "stream"): server.url + "/webcam/stream?fps=15",
+        ("webcam", "ffmpeg"): "ffmpeg",
+        ("webcam", "flipH"): False,
+        ("webcam", "flipV"): False,
+        ("webcam", "rotate90"): False
+    }
+
+    plugin._settings = FakeSettings(plugin.get_settings_defaults(), settings, webcam)
+    plugin.on_settings_initialized()
+    plugin.on_event(Events.STARTUP, None)
+    return plugin
+
+def run_send(plugin, server, args):
+    from concurrent.futures import ThreadPoolExecutor
+
+    latencies = []
+    lock = threading.Lock()
+
+    def one(i):
+        start = time.time()
+        octoprint_signalclirestapi.defer_send_message(plugin, "bench-%d" % i, args.snapshots, False)
+        with lock:
+            latencies.append(time.time() - start)
+
+    start = time.time()
+    with ThreadPoolExecutor(max_workers=args.concurrency) as executor:
+        list(executor.map(one, range(args.n)))
+    elapsed = time.time() - start
+    return len(sent_markers(server.state)), elapsed, latencies
+
+def run_storm(plugin, server, args, submit):
+    submitted = {}
+    start = time.time()
+    for i in range(args.n):
+        submitted[i] = time.time()
+        submit(i)
+    wait_delivered(plugin, server, args)
+    markers = sent_markers(server.state)
+    elapsed = (max(markers.values()) if markers else time.time()) - start
+    return len(markers), elapsed, [markers[i] - submitted[i] for i in markers if i in submitted]
+
+# until everything arrived, or the send queue has been idle for a second (dropped or rate limited messages)
+def wait_delivered(plugin, server, args):
+    deadline = time.time() + args.timeout
+    idle_since = None
+    while time.time() < deadline and server.state.wait_sent(args.n, 0.1) < args.n:
+        stats = plugin._dispatcher.stats()
+        if stats["queue_depth"] or stats["busy"]:
+            idle_since = None
+        elif idle_since is None:
+            idle_since = time.time()
+        elif time.time() - idle_since > 1:
+            break
+
+def run_events(plugin, server, args):
+    return run_storm(plugin, server, args, lambda i: plugin.on_event(Events.PRINT_DONE, {"name": "bench-%d" % i, "time": 60}))
+
+def run_progress(plugin, server, args):
+    def submit(i):
+        # every 100 messages are a new job, each threshold fires once per job
+        if i % 100 == 0:
+            plugin._start_progress()
+        plugin.on_print_progress("local", "bench-%d" % i, i % 100 + 1)
+    return run_storm(plugin, server, args, submit)
+
+def run_inbound(plugin, server, args):
+    printer = plugin._printer
+    pushed = {}
+    start = time.time()
+    for i in range(args.n):
+        pushed[i] = time.time()
+        server.state.push_inbound("gcode M117 bench-%d" % i, RECIPIENT)
+
+    deadline = time.time() + args.timeout
+    while time.time() < deadline:
+        with printer.lock:
+            if len(printer.commands_seen) >= args.n:
+                break
+        time.sleep(0.01)
+
+    with printer.lock:
+        seen = list(printer.commands_seen)
+    handled = dict((int(command.rsplit("-", 1)[1]), when) for when, command in seen)
+    elapsed = (max(handled.values()) if handled else time.time()) - start
+    return len(handled), elapsed, [handled[i] - pushed[i] for i in handled]
+
+# a fresh plugin per round, its receive threads must be gone when SHUTDOWN returns
+def run_shutdown(plugin, server, args):
+    latencies = []
+    stopped = 0
+    start = time.time()
+    for i in range(args.n):
+        if i > 0:
+            plugin = make_plugin(server, args, plugin.get_plugin_data_folder(), plugin._settings.overrides)
+            time.sleep(args.warmup)
+        threads = list(plugin._receive_threads.values())
+        begin = time.time()
+        plugin.on_event(Events.SHUTDOWN, None)
+        latencies.append(time.time() - begin)
+        if not any(thread.is_alive() for thread in threads):
+            stopped += 1
+    return stopped, time.time() - start, latencies
+
+SCENARIOS = (
+    ("send", run_send),
+    ("events", run_events),
+    ("progress", run_progress),
+    ("inbound", run_inbound),
+    ("shutdown", run_shutdown)
+)
+
+def run_scenario(name, fn, args, overrides):
+    state = FakeSignalState(mode=args.mode, latency=args.latency, jitter=args.jitter, failure_rate=args.failure_rate,
+                            rate_limit_rate=args.rate_limit_rate, frame_size=args.frame_size * 1024)
+    server = FakeSignalServer(state).start()
+    data_folder = tempfile.mkdtemp(prefix="signalclirestapi-bench-")
+    sampler = Sampler()
+    sampler.start()
+
+    plugin = make_plugin(server, args, data_folder, overrides)
+    try:
+        # let the receive thread connect and the frame buffer fill before the clock starts
+        time.sleep(args.warmup)
+        delivered, elapsed, latencies = fn(plugin, server, args)
+    finally:
+        plugin.on_event(Events.SHUTDOWN, None)
+        sampler.stop()
+        server.stop()
+        shutil.rmtree(data_folder, ignore_errors=True)
+
+    return dict(
+        scenario=name,
+        messages=args.n,
+        delivered=delivered,
+        seconds=round(elapsed, 3),
+        per_second=round(delivered / elapsed, 1) if elapsed > 0 else None,
+        p50_ms=round(percentile(latencies, 0.5) * 1000, 1) if latencies else None,
+        p99_ms=round(percentile(latencies, 0.99) * 1000, 1) if latencies else None,
+        peak_threads=sampler.peak_threads,
+        peak_rss_mb=round(sampler.peak_rss / 1024.0 / 1024.0, 1),
+        requests=dict(state.requests),
+        metrics=plugin.metrics.as_dict() if args.metrics else None
+    )
+
+def print_table(results):
+    columns = ("scenario", "messages", "delivered", "seconds", "per_second", "p50_ms", "p99_ms", "peak_threads", "peak_rss_mb")
+    print("  ".join("{:>12}".format(c) for c in columns))
+    for result in results:
+        print("  ".join("{:>12}".format(str(result[c])) for c in columns))
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark OctoPrint-Signalclirestapi against a local fake signal-cli-rest-api")
+    parser.add_argument("--scenario", default="all", choices=["all"] + [name for name, _ in SCENARIOS])
+    parser.add_argument("-n", type=int, default=200, help="messages per scenario")
+    parser.add_argument("--concurrency", type=int, default=4, help="caller threads of the send scenario")
+    parser.add_argument("--mode", default="normal", choices=["normal", "native", "json-rpc"], help="signal-cli-rest-api mode to emulate")
+    parser.add_argument("--latency", type=float, default=0.0, help="seconds the fake server takes per REST call")
+    parser.add_argument("--jitter", type=float, default=0.0, help="+/- seconds added to the latency")
+    parser.add_argument("--failure-rate", type=float, default=0.0, help="share of sends failing with an error")
+    parser.add_argument("--rate-limit-rate", type=float, default=0.0, help="share of sends failing with a rate limit error")
+    parser.add_argument("--snapshots", action="store_true", help="attach webcam snapshots")
+    parser.add_argument("--frame-buffer", action="store_true", help="serve snapshots from the MJPEG frame buffer")
+    parser.add_argument("--frame-size", type=int, default=64, help="KB per fake webcam frame")
+    parser.add_argument("--rate-limit", action="store_true", help="keep the outbound rate limiter enabled")
+    parser.add_argument("--warmup", type=float, default=1.0, help="seconds to wait after startup")
+    parser.add_argument("--timeout", type=float, default=120.0, help="seconds to wait for a storm to be delivered")
+    parser.add_argument("--set", action="append", default=[], metavar="KEY=VALUE", help="override a plugin setting")
+    parser.add_argument("--metrics", action="store_true", help="include the plugin's own stage metrics in the json output")
+    parser.add_argument("--json", action="store_true", help="print the results as json")
+    parser.add_argument("--verbose", action="store_true")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.DEBUG if args.verbose else logging.ERROR)
+    overrides = dict(item.split("=", 1) for item in args.set)
+
+    results = []
+    for name, fn in SCENARIOS:
+        if args.scenario in ("all", name):
+            results.append(run_scenario(name, fn, args, overrides))
+
+    if args.json:
+        print(json.dumps(results, indent=2))
+    else:
+        print_table(results)
+
+if __name__ == "__main__":
+    main()
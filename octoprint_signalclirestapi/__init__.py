@@ -7,24 +7,38 @@ import octoprint.util
 from octoprint.events import Events
 
 import flask
-from pysignalclirestapi import SignalCliRestApi
 from datetime import datetime, timedelta
 
-try:
-    from urllib.request import urlretrieve
-except ImportError:
-    from urllib import urlretrieve
-import tempfile
 import socket
 import getpass
 import time
+import random
 import threading
 import subprocess
 
 import websocket
 import json
 import os
-import requests
+import re
+
+from .attachment import Attachment
+from .client import SignalRestClient
+from .config import PluginConfig
+from .coalesce import Coalescer, EVENT_CLASSES, BYPASS_EVENTS, FLUSH_EVENTS, CLASS_PROGRESS, get_priority
+from .message_template import MessageTemplate, TemplateError
+from .dispatcher import SendDispatcher, FanOut, KIND_EVENT, KIND_PROGRESS, KIND_REPLY
+from .webcam import SnapshotProvider, FrameBuffer, MjpegCaptureThread
+from .imaging import SnapshotProcessor, SnapshotOptions
+from .ratelimit import RateLimiter, PRIORITY_LOW, PRIORITY_NORMAL, is_rate_limit_error
+from .journal import OutboundJournal
+from .groups import GroupIndex
+from .metrics import Metrics
+from .senders import SenderPool
+from .dedup import RecentSet
+from .printer_state import PrinterStateCache
+from .progress import ProgressScheduler, LAYER_CHANGED_EVENT
+from .digest import ProgressDigest
+from .commands import Command, CommandRegistry, COMMANDS_HOOK, get_builtin_commands
 #
 # register a new device
 # signal-cli --config /home/.local/share/signal-cli  -a ACCOUNT register --voice
@@ -50,174 +64,277 @@ import requests
 # add device on master
 # signal-cli --config /home/.local/share/signal-cli -a {number} addDevice --uri "{uuid}"
 #
+# Receives inbound messages, either by polling (normal/native mode) or through the json-rpc websocket.
+#
+# The websocket is read with a timeout; when it has been quiet for a heartbeat interval we send a ping
+# and if nothing (not even the pong) arrives within the next interval the connection is considered
+# half-open and dropped. Reconnects back off exponentially with jitter. All waits go through an Event so
+# that shutdown() returns right away instead of hanging in recv() or sleep().
 class ReceiveThread(threading.Thread):
     def __init__(self, *args, **kwargs):
         super(ReceiveThread, self).__init__(*args, **kwargs)
 
         self._plugin = None
+        self._logger = None
+        self._sender = None
         self._api = None
         self._websocket = None
-
-    # must be called before start
-    def set_plugin(self, plugin):
+        self._stop_event = threading.Event()
+        self._ping_sent = None
+        self._poll_interval = None
+
+        self._failures = 0
+        self._reconnects = 0
+        self._connected = False
+        self._disconnected_since = time.time()
+        self._disconnected_total = 0.0
+        self._last_message = None
+
+    # must be called before start, every sender account of the pool gets its own receive thread
+    def set_plugin(self, plugin, sender):
         self._plugin = plugin
+        self._logger = plugin._logger
+        self._sender = sender
 
     def restart(self):
-        self.shutdown(releasePlugin=False)
- 
+        self._close()
+
     def shutdown(self, releasePlugin=True):
+        if releasePlugin:
+            self._stop_event.set()
+        self._close()
+        if releasePlugin: self._plugin = None
+
+    def _close(self):
+        websocket_ = self._websocket
+        self._websocket = None
+        self._api = None
+        self._ping_sent = None
+        self._set_connected(False)
         try:
-            if self._websocket:
-                self._websocket.close()
+            # no closing handshake, a half-open connection would keep us waiting for the reply. Closing the
+            # socket alone does not wake up a recv() blocked in the receive thread, shutting it down does.
+            if websocket_:
+                if websocket_.sock:
+                    try:
+                        websocket_.sock.shutdown(socket.SHUT_RDWR)
+                    except socket.error:
+                        pass
+                websocket_.shutdown()
         except Exception as e:
-            self._plugin._logger.exception("ReceiveThread: shutdown exception: [{}]".format(e))
-        finally:
-            self._websocket = None
-            self._api = None
-            if releasePlugin: self._plugin = None
-        
-    def run(self):
-        valid_commands = ("STATUS", "PAUSE", "RESUME", "CANCEL", "GCODE", "TOOL", "BED", "CHAMBER", "CONNECT", "DISCONNECT", "SHELL", "STOP", "RESTART", "SHUTDOWN", "REBOOT")
-        helpMsg = (
-            "I respond to a number of different commands:\n\n" +
-            "\tstatus\t\t\t\tmachine / job status\n" +
-            "\tpause\t\t\t\tpause current job\n" +
-            "\tresume\t\t\tresume current job\n" +
-            "\tcancel\t\t\t\tcancel current job\n" +
-            "\tgcode ###\t\tsend gcode\n" +
-            "\ttool ###\t\t\ttool temperature\n" +
-            "\tbed ###\t\t\tbed temperature\n" +
-            "\tchamber ###\tchamber temperature\n" +
-            "\tconnect\t\t\tconnect to machine\n" +
-            "\tdisconnect\t\tdisconnect machine\n" +
-            "\tshell ###\t\t\texecute command\n" +
-            "\tstop\t\t\t\t\tstops Octoprint\n" +
-            "\trestart\t\t\t\trestarts Octoprint\n" +
-            "\tshutdown\t\tshutdown our server\n" +
-            "\treboot\t\t\t\treboot our server"
+            self._logger.exception("ReceiveThread: shutdown exception: [{}]".format(e))
+
+    def _set_connected(self, connected):
+        now = time.time()
+        if connected and not self._connected:
+            if self._disconnected_since is not None:
+                self._disconnected_total += now - self._disconnected_since
+            self._disconnected_since = None
+        elif not connected and self._connected:
+            self._disconnected_since = now
+        self._connected = connected
+
+    def stats(self):
+        disconnected = self._disconnected_total
+        if self._disconnected_since is not None:
+            disconnected += time.time() - self._disconnected_since
+        return dict(
+            connected=self._connected,
+            reconnects=self._reconnects,
+            consecutive_failures=self._failures,
+            disconnected_seconds=round(disconnected, 3),
+            last_message=self._last_message,
+            poll_interval=self._poll_interval
         )
+
+    def run(self):
         mode = None
 
-        while self._plugin:
+        while not self._stop_event.is_set():
+            plugin = self._plugin
+            if not plugin:
+                break
+
             try:
-                if self._plugin.enabled:
-                    if not self._api:
-                        self._api = SignalCliRestApi(self._plugin.url, self._plugin.sender)
-                        mode = self._api.mode()
-
-                    # use a websocket if json-rpc is enabled
-                    if not self._websocket and mode == "json-rpc":
-                        self._websocket = websocket.create_connection(self._plugin.url.replace("http://", "ws://") + "/v1/receive/" + self._plugin.sender)
-
-                    if mode == "json-rpc":
-                        msgs = [ json.loads(self._websocket.recv()) ]
-                    else:
-                        msgs = receive_message(self._plugin.url, self._plugin.sender)
-
-                    for msg in msgs:
-                        message = None
-                        sourceNumber = None
-                        groupId = None
-
-                        # only process data messages with a source number matching our known recipients
-                        if "envelope" in msg.keys() and "dataMessage" in msg["envelope"].keys() and "sourceNumber" in msg["envelope"].keys():
-                            # DO NOT proceed if we do not know this sender
-                            sourceNumber = msg["envelope"]["sourceNumber"]
-                            if not sourceNumber or not sourceNumber in self._plugin.recipients:
-                                self._plugin._logger.warn("ReceiveThread: ignoring message from unknown sender [{}]".format(sourceNumber))
-                                continue
-
-                            dataMsg = msg["envelope"]["dataMessage"]
-                            if "message" in dataMsg.keys(): message = dataMsg["message"]
-                            # only process a message if it isn't empty
-                            if message: 
-                                message = message.strip() 
-                            else: 
-                                self._plugin._logger.debug("ReceiveThread: dropping empty message from [{}]".format(sourceNumber))
-                                continue
-
-                            # set the group id if the message is from one
-                            if "groupInfo" in dataMsg.keys() and "groupId" in dataMsg["groupInfo"].keys(): groupId = dataMsg["groupInfo"]["groupId"]
-
-                            # we only want to respond to messages meant for us
-                            if groupId is None or groupId == self._plugin._group_id["internal_id"]:
-                                self._plugin._logger.debug("ReceiveThread: message=[{}] group=[{}] sourceNumber=[{}]".format(message, groupId, sourceNumber)) 
-
-                                # display a help message if we receive something we do not understand
-                                command = "" if message is None else message.split(" ")[0]
-                                if command.upper() not in valid_commands:
-                                    self._plugin._send_message(helpMsg, snapshot=False)    
-                                    continue
-
-                                if command.upper() == "STATUS":
-                                    self._plugin.on_demand_status_report()
-                                elif command.upper() == "PAUSE":
-                                    self._plugin._printer.pause_print()
-                                elif command.upper() == "RESUME":
-                                    self._plugin._printer.resume_print()
-                                elif command.upper() == "CANCEL":
-                                    self._plugin._printer.cancel_print()
-                                elif command.upper() == "GCODE":
-                                    self._plugin._printer.commands(message.replace(command + " ", ""))
-                                elif command.upper() == "TOOL":
-                                    self._plugin._printer.set_temperature("tool0", float(message.replace(command + " ", "")))
-                                elif command.upper() == "BED":
-                                    self._plugin._printer.set_temperature("bed", float(message.replace(command + " ", "")))
-                                elif command.upper() == "CHAMBER":
-                                    self._plugin._printer.set_temperature("chamber", float(message.replace(command + " ", "")))
-                                elif command.upper() == "CONNECT":
-                                    self._plugin._printer.connect()
-                                elif command.upper() == "DISCONNECT":
-                                    self._plugin._printer.disconnect()
-                                elif command.upper() == "SHELL":
-                                    subprocess.call(message.replace(command + " ", ""), shell=True)
-                                elif command.upper() == "STOP":
-                                    cmd = "sudo service octoprint stop"
-                                    subprocess.call(cmd, shell=True)
-                                elif command.upper() == "RESTART":
-                                    cmd = self._plugin._settings.global_get(["server", "commands", "serverRestartCommand"])
-                                    subprocess.call(cmd, shell=True)
-                                elif command.upper() == "SHUTDOWN":
-                                    cmd = self._plugin._settings.global_get(["server", "commands", "systemShutdownCommand"])
-                                    subprocess.call(cmd, shell=True)
-                                elif command.upper() == "REBOOT":
-                                    cmd = self._plugin._settings.global_get(["server", "commands", "systemRestartCommand"])
-                                    subprocess.call(cmd, shell=True)
-                            else:
-                                self._plugin._logger.debug("signal_receive_thread dropping message [{}] from [{}]".format(message, sourceNumber))
-            except BaseException as e:
-                if self._plugin:
-                    self._plugin._logger.warn("ReceiveThread: main loop exception: [{}]".format(e))
-                    time.sleep(5)
-                    self.restart()
-            finally:
-                if (self._plugin and not self._plugin.enabled) or (self._api and mode != "json-rpc"):
-                    time.sleep(1)
-    
-        self.shutdown()
-        self._plugin._logger.debug("signal_receive_thread shutdown")
+                if not plugin.enabled:
+                    self._stop_event.wait(1)
+                    continue
+
+                if not self._api:
+                    if self._failures:
+                        self._reconnects += 1
+                    self._api = plugin.client_for(self._sender)
+                    mode = self._api.mode()
+
+                if mode == "json-rpc":
+                    msgs = self._receive_json_rpc(plugin)
+                else:
+                    msgs = self._receive_poll(plugin)
+
+                self._failures = 0
+                for msg in msgs:
+                    self._last_message = time.time()
+                    plugin.metrics.inc("inbound_messages")
+                    try:
+                        with plugin.metrics.time("receive_handle"):
+                            self._handle_message(plugin, msg)
+                    except Exception as e:
+                        self._logger.exception("ReceiveThread: could not handle message: [{}]".format(e))
+
+                if mode != "json-rpc":
+                    self._adapt_poll_interval(plugin, msgs)
+                    if not plugin.config.receive_long_poll:
+                        self._stop_event.wait(self._poll_interval)
+            except Exception as e:
+                if self._stop_event.is_set():
+                    break
+                self._failures += 1
+                delay = self._backoff(plugin)
+                self._logger.warning("ReceiveThread: main loop exception, reconnecting in [{:.1f}s]: [{}]".format(delay, e))
+                self._close()
+                self._stop_event.wait(delay)
+
+        self._close()
+        self._logger.debug("signal_receive_thread shutdown")
+
+    def _backoff(self, plugin):
+        config = plugin.config
+        delay = min(config.receive_backoff_max, config.receive_backoff_min * (2 ** (self._failures - 1)))
+        # full jitter on the upper half keeps a fleet of printers from reconnecting in lockstep
+        return delay / 2 + random.uniform(0, delay / 2)
+
+    # with long polling signal-cli itself waits up to poll_interval seconds for new messages, so an idle
+    # printer costs one receive per interval instead of one per second
+    def _receive_poll(self, plugin):
+        if self._poll_interval is None:
+            self._poll_interval = plugin.config.receive_poll_min
+
+        if plugin.config.receive_long_poll:
+            msgs = receive_message(self._api, wait=self._poll_interval)
+        else:
+            msgs = receive_message(self._api)
+        self._set_connected(True)
+        return msgs
+
+    # poll fast right after a message or while printing, back off towards the ceiling while idle
+    def _adapt_poll_interval(self, plugin, msgs):
+        config = plugin.config
+        if msgs or plugin._printer_state.snapshot.printing:
+            self._poll_interval = config.receive_poll_min
+        else:
+            self._poll_interval = min(config.receive_poll_max, max(config.receive_poll_min, self._poll_interval * 1.5))
+
+    def _receive_json_rpc(self, plugin):
+        heartbeat = plugin.config.receive_heartbeat
+
+        if not self._websocket:
+            url = plugin.url.replace("https://", "wss://").replace("http://", "ws://") + "/v1/receive/" + self._sender
+            self._websocket = websocket.create_connection(url, timeout=heartbeat)
+            self._ping_sent = None
+            self._set_connected(True)
+            self._logger.debug("ReceiveThread: websocket connected")
+
+        try:
+            opcode, data = self._websocket.recv_data(control_frame=True)
+        except websocket.WebSocketTimeoutException:
+            if self._ping_sent is not None:
+                raise Exception("no heartbeat for [{:.0f}s] - connection is dead".format(time.time() - self._ping_sent))
+            self._websocket.ping()
+            self._ping_sent = time.time()
+            return []
+
+        # any frame proves the connection is alive
+        self._ping_sent = None
+
+        if opcode == websocket.ABNF.OPCODE_CLOSE:
+            raise Exception("websocket closed by server")
+        if opcode == websocket.ABNF.OPCODE_TEXT:
+            return [json.loads(data.decode("utf-8") if isinstance(data, bytes) else data)]
+        return []
+
+    def _handle_message(self, plugin, msg):
+        message = None
+        sourceNumber = None
+        groupId = None
+
+        # only process data messages with a source number matching our known recipients
+        if "envelope" in msg.keys() and "dataMessage" in msg["envelope"].keys() and "sourceNumber" in msg["envelope"].keys():
+            # DO NOT proceed if we do not know this sender
+            sourceNumber = msg["envelope"]["sourceNumber"]
+            if not sourceNumber or not sourceNumber in plugin.config.allowed_senders:
+                plugin._logger.warn("ReceiveThread: ignoring message from unknown sender [{}]".format(sourceNumber))
+                return
+
+            dataMsg = msg["envelope"]["dataMessage"]
+            if "message" in dataMsg.keys(): message = dataMsg["message"]
+            # only process a message if it isn't empty
+            if message: 
+                message = message.strip() 
+            else: 
+                plugin._logger.debug("ReceiveThread: dropping empty message from [{}]".format(sourceNumber))
+                return
+
+            # set the group id if the message is from one
+            if "groupInfo" in dataMsg.keys() and "groupId" in dataMsg["groupInfo"].keys(): groupId = dataMsg["groupInfo"]["groupId"]
+
+            # reconnects may deliver the same envelope again, and a group message reaches every account of the pool
+            timestamp = msg["envelope"].get("timestamp") or dataMsg.get("timestamp")
+            if timestamp is not None and not plugin.seen_envelopes.add((sourceNumber, timestamp)):
+                plugin._logger.debug("ReceiveThread: dropping duplicate message [{}] from [{}]".format(timestamp, sourceNumber))
+                plugin.metrics.inc("inbound_duplicates")
+                return
+
+            # we only want to respond to messages meant for us
+            if groupId is None or plugin.is_current_group(groupId):
+                plugin._logger.debug("ReceiveThread: message=[{}] group=[{}] sourceNumber=[{}]".format(message, groupId, sourceNumber)) 
+
+                # display a help message if we receive something we do not understand
+                commands = plugin.commands
+                if not commands.dispatch(plugin, message, source=sourceNumber, group=groupId):
+                    plugin._send_message(commands.help_message(), snapshot=False, kind=KIND_REPLY)
+            else:
+                plugin._logger.debug("signal_receive_thread dropping message [{}] from [{}]".format(message, sourceNumber))
 
 # MODE = normal receive only (do not use this for json-rpc)
-def receive_message(url, sender_nr):
-    if url is None or sender_nr is None or len(url) == 0 or len(sender_nr) == 0: return
-    return SignalCliRestApi(url, sender_nr).receive()
+def receive_message(client, wait=None):
+    if client.url is None or client.sender is None or len(client.url) == 0 or len(client.sender) == 0: return []
+    return client.receive(wait=wait)
 
 def verify_connection_settings(url, sender_nr, recipients):
     if url is None or url == "":
         raise Exception("REST API URL needs to be set")
     if sender_nr is None or sender_nr == "":
         raise Exception("Sender Number needs to be set")
-    if recipients is None or recipients == "":
+    if not recipients:
         raise Exception("Please provide at least one recipient") 
 
-def defer_send_message(_plugin, message, snapshot, snapshot_as_gif):
+# attachments are only passed in when a journaled message is replayed with the media of its first attempt,
+# recipients when only some of the recipients got it the first time
+#
+# The stages overlap: the capture starts right away while the group is resolved and the send budget is
+# acquired, the typing indicator goes out while the capture is still running, and the message is sent
+# as soon as the capture is done.
+def defer_send_message(_plugin, message, snapshot, snapshot_as_gif, priority=PRIORITY_NORMAL, journal_id=None, attachments=None, recipients=None, journal=None):
+    attachments = list(attachments or [])
+    error = None
+    failed_recipients = None
+    metrics = _plugin.metrics
+    budget = None
+    capture = None
+    start = time.time()
     try:
         _plugin._logger.debug("defer_send_message: preparing message")
 
-        recipients = _plugin.recipients
+        if _plugin.attach_snapshots and snapshot and not attachments:
+            capture = _plugin.stages.submit(capture_attachment, _plugin, snapshot_as_gif)
 
+        # a retry only goes to the recipients that did not get the message before
+        if recipients:
+            _plugin._logger.debug("defer_send_message: retrying for [{}] recipients".format(len(recipients)))
         # check group settings and set group id if applicible 
-        if _plugin.create_group_for_every_print or _plugin.create_group_by_printer:
+        elif _plugin.create_group_for_every_print or _plugin.create_group_by_printer:
+            recipients = _plugin.recipients
+
             if _plugin.create_group_for_every_print and _plugin._group_id is None:
                 _plugin._create_group_if_not_exists()
 
@@ -229,35 +346,42 @@ def defer_send_message(_plugin, message, snapshot, snapshot_as_gif):
                 _plugin._logger.warn("Cannot send message due to missing group id - using recipient list instead")
             else:
                 recipients = [_plugin._group_id["id"]]
+        else:
+            recipients = _plugin.recipients
+
+        with metrics.time("rate_limit_wait"):
+            budget = acquire_send_budget(_plugin, recipients, priority)
+        if not budget:
+            error = "send budget exhausted"
+            metrics.inc("messages_dropped")
+            return
 
         # typing indicator - turn on
-        for recipient in recipients:
-            requests.put(_plugin.url + "/v1/typing-indicator/" + _plugin.sender, json={"recipient": recipient})
+        typing = _plugin.stages.submit(send_typing_indicator, _plugin, recipients)
 
-        snapshot_filenames = []
-        if _plugin.attach_snapshots and snapshot:
-            try:
-                if not snapshot_as_gif:
-                    snapshot_filenames.append(get_webcam_snapshot(_plugin.snapshot_url))
-                else:
-                    gif = get_webcam_animated_gif(_plugin)
-                    if gif: snapshot_filenames.append(gif)
-            except BaseException as e:
-                _plugin._logger.exception("Could not get webcam image...sending without it: [{}]".format(e))
+        if capture is not None:
+            with metrics.time("capture_wait"):
+                attachment = capture.result()
+            capture = None
+            if attachment: attachments.append(attachment)
+
+            # the indicator times out after a while on the phone, a long capture needs it again
+            if time.time() - start > TYPING_REFRESH:
+                typing.result()
+                typing = _plugin.stages.submit(send_typing_indicator, _plugin, recipients)
 
         _plugin._logger.debug("defer_send_message: sending message")
 
-        # typing indicator - turn on again
-        for recipient in recipients:
-            requests.put(_plugin.url + "/v1/typing-indicator/" + _plugin.sender, json={"recipient": recipient})
+        with metrics.time("send"):
+            failures = send_rate_limited(_plugin, message, recipients, attachments, priority)
 
-        send_message(_plugin.url, _plugin.sender, message, recipients, snapshot_filenames)
+        # typing indicator - turn off, never before it was turned on
+        typing.result()
+        send_typing_indicator(_plugin, recipients, typing=False)
 
-        # typing indicator - turn off
-        for recipient in recipients:
-            requests.delete(_plugin.url + "/v1/typing-indicator/" + _plugin.sender, json={"recipient": recipient})
-
-        _plugin._logger.debug("defer_send_message: messge sent")
+        failed_recipients, error = check_failures(_plugin, recipients, failures)
+        if error is None:
+            _plugin._logger.debug("defer_send_message: messge sent")
     except BaseException as e:
         if "Group not found" in str(e):
             _plugin._logger.warning("group does not exist - trying again with recipient list")
@@ -266,79 +390,325 @@ def defer_send_message(_plugin, message, snapshot, snapshot_as_gif):
             _plugin._settings.set(["printergroupid"], {})
             _plugin._settings.save()
             try:
-                send_message(_plugin.url, _plugin.sender, message, _plugin.recipients, snapshot_filenames)
-                _plugin._logger.debug("defer_send_message: messge sent")
+                recipients = _plugin.recipients
+                failed_recipients, error = check_failures(_plugin, recipients, send_rate_limited(_plugin, message, recipients, attachments, priority))
+                if error is None:
+                    _plugin._logger.debug("defer_send_message: messge sent")
             except BaseException as e:
+                error = e
                 _plugin._logger.exception("Could not send signal message after clearing group_id: []".format(e))    
         else:
+            error = e
             _plugin._logger.exception("Could not send signal message: [{}]".format(e))    
     finally:
-        if snapshot_as_gif and snapshot_filenames:
-            os.remove(snapshot_filenames[0])
-
-def send_message(url, sender_nr, message, recipients, filenames=[]):
-    verify_connection_settings(url, sender_nr, recipients) 
-    SignalCliRestApi(url, sender_nr).send_message(message, recipients, filenames=filenames)
+        if error is None:
+            metrics.inc("messages_sent")
+            metrics.observe("deliver", time.time() - start)
+        elif budget is not False:
+            metrics.inc("messages_failed")
+        if journal_id is not None:
+            finish_journal_entry(_plugin, journal, journal_id, error, attachments, failed_recipients)
+        close_attachments(attachments)
+        # a capture we did not wait for cleans up after itself
+        if capture is not None:
+            capture.add_done_callback(close_captured)
+
+# the contact sheet is only put together on the send worker, a digest dropped from the queue costs nothing
+def send_digest(_plugin, message, frames, priority):
+    attachments = []
+    if frames:
+        try:
+            with _plugin.metrics.time("contact_sheet"):
+                data = _plugin.snapshot_processor.contact_sheet(frames, _plugin.snapshot_options)
+            if data is None:
+                # without Pillow the most recent frame stands in for the sheet
+                data = _plugin.snapshot_processor.process(frames[-1], _plugin.snapshot_options)
+            attachments.append(Attachment.from_bytes(data, _plugin.attachment_spill_size, ".jpg"))
+        except Exception as e:
+            _plugin._logger.exception("send_digest: could not build contact sheet...sending without it: [{}]".format(e))
+    _plugin.metrics.inc("digests_sent")
+    defer_send_message(_plugin, message, False, False, priority, attachments=attachments)
 
-def create_group(_plugin, name):
-    api = SignalCliRestApi(_plugin.url, _plugin.sender) 
-    group_id = api.create_group(name, _plugin.recipients)
+def capture_attachment(_plugin, snapshot_as_gif):
+    metrics = _plugin.metrics
+    try:
+        if not snapshot_as_gif:
+            with metrics.time("snapshot"):
+                return get_webcam_snapshot(_plugin)
+        if _plugin.animation_format == "clip":
+            with metrics.time("clip"):
+                return get_webcam_clip(_plugin)
+        with metrics.time("gif"):
+            return get_webcam_animated_gif(_plugin)
+    except BaseException as e:
+        _plugin._logger.exception("Could not get webcam image...sending without it: [{}]".format(e))
+    return None
 
-    groups = api.list_groups()
+# everyone failing is an error of the message as a whole, otherwise the ones that failed are returned
+# together with an error so that the message counts as failed and only they get it again
+def check_failures(_plugin, recipients, failures):
+    if not failures:
+        return None, None
+    if len(failures) >= len(set(recipients)):
+        raise list(failures.values())[0]
+    failed = sorted(failures)
+    _plugin.metrics.inc("recipients_failed", len(failed))
+    return failed, "failed for [{}] of [{}] recipients: [{}]".format(len(failed), len(set(recipients)), list(failures.values())[0])
+
+# the journal the message was recorded in, it stays open for us even if the settings closed it meanwhile
+def finish_journal_entry(_plugin, journal, journal_id, error, attachments, recipients=None):
+    if journal is None:
+        return
+    try:
+        if error is None:
+            journal.complete(journal_id)
+        else:
+            journal.failed(journal_id, error, attachments, recipients)
+    except Exception as e:
+        _plugin._logger.exception("finish_journal_entry: [{}]".format(e))
+
+def acquire_send_budget(_plugin, recipients, priority):
+    if not _plugin.rate_limit_enabled:
+        return True
+    limiter = _plugin.rate_limiter
+    return limiter.acquire(limiter.keys(_plugin.shards(recipients)), priority)
+
+# feeds rate limit responses back into the buckets of the throttled recipients and their senders, anything
+# but low priority gets one more try for those recipients; returns the recipients that did not get the
+# message with their errors
+def send_rate_limited(_plugin, message, recipients, attachments, priority):
+    if not _plugin.rate_limit_enabled:
+        return send_to_recipients(_plugin, message, recipients, attachments)
+
+    limiter = _plugin.rate_limiter
+    # taken before sending, a throttled sender is skipped by the pool afterwards
+    shards = _plugin.shards(recipients)
+    failures = send_to_recipients(_plugin, message, recipients, attachments)
+
+    throttled = [recipient for recipient, error in failures.items() if is_rate_limit_error(error)]
+    if throttled:
+        throttled_keys = limiter.keys(subshards(shards, throttled))
+        limiter.rate_limited(throttled_keys)
+        if priority != PRIORITY_LOW and limiter.acquire(throttled_keys, priority):
+            for recipient in throttled:
+                del failures[recipient]
+            failures.update(send_to_recipients(_plugin, message, throttled, attachments))
+
+    delivered = [recipient for recipient in recipients if recipient not in failures]
+    if delivered:
+        limiter.succeeded(limiter.keys(subshards(shards, delivered)))
+    return failures
+
+# the part of a sender -> recipients mapping that covers the given recipients
+def subshards(shards, recipients):
+    recipients = set(recipients)
+    result = {}
+    for sender, members in shards.items():
+        members = [recipient for recipient in members if recipient in recipients]
+        if members:
+            result[sender] = members
+    return result
+
+def send_typing_indicator(_plugin, recipients, typing=True):
+    _plugin.fan_out.run("typing-on" if typing else "typing-off", lambda recipient: _plugin.client_for(_plugin.sender_for(recipient)).typing_indicator(recipient, typing=typing), recipients)
+
+def send_message(client, message, recipients, attachments=[]):
+    verify_connection_settings(client.url, client.sender, recipients) 
+    client.send_message(message, recipients, attachments=attachments)
+
+# one request per sender of the pool, the shards go out in parallel; returns the recipients that failed
+# with their errors
+def send_to_recipients(_plugin, message, recipients, attachments=[]):
+    verify_connection_settings(_plugin.url, _plugin.sender, recipients)
+    shards = _plugin.shards(recipients)
+    failures = {}
+
+    def send_shard(sender):
+        failures.update(send_with_failover(_plugin, message, sender, shards[sender], attachments))
+
+    for sender, error in _plugin.fan_out.run("send", send_shard, list(shards)).items():
+        for recipient in shards[sender]:
+            failures.setdefault(recipient, error)
+    return failures
+
+# A group can only be sent to by the account that created it, direct recipients fail over to the next
+# sender in their ranking. Since signal-cli fails the whole request for a single bad number, a shard
+# that fails for any other reason than throttling is tried once more recipient by recipient.
+def send_with_failover(_plugin, message, sender, recipients, attachments):
+    pool = _plugin.sender_pool
+    failures = {}
+    tried = dict((recipient, set()) for recipient in recipients)
+    pending = [(sender, list(recipients))]
+    while pending:
+        sender, members = pending.pop(0)
+        try:
+            _plugin.client_for(sender).send_message(message, members, attachments=attachments)
+            continue
+        except Exception as e:
+            error = e
+        for recipient in members:
+            tried[recipient].add(sender)
+
+        if pool.failed(sender, error):
+            fallback = {}
+            for recipient in members:
+                following = None
+                if not _plugin.group_sender(recipient):
+                    following = next((s for s in pool.ranked(recipient) if s not in tried[recipient] and pool.available(s)), None)
+                if following:
+                    fallback.setdefault(following, []).append(recipient)
+                else:
+                    failures[recipient] = error
+            for following, moved in fallback.items():
+                _plugin._logger.info("send_with_failover: [{}] failed for [{}] recipients, trying [{}]".format(sender, len(moved), following))
+                pending.append((following, moved))
+        elif len(members) > 1 and not is_rate_limit_error(error):
+            _plugin._logger.info("send_with_failover: [{}] failed for [{}] recipients, sending one by one: [{}]".format(sender, len(members), error))
+            pending.extend((sender, [recipient]) for recipient in members)
+        else:
+            for recipient in members:
+                failures[recipient] = error
+    return failures
 
-    for group in groups:
-        if group["id"] == group_id:
-            return { "id": group_id, "internal_id": group["internal_id"] }
+def create_group(_plugin, name):
+    # groups are spread over the sender pool by name, the creating account is the only one that can send to it
+    sender = _plugin.sender_pool.pick(name)
+    with _plugin.metrics.time("group_create"):
+        group_id = _plugin.client_for(sender).create_group(name, _plugin.recipients)
+        internal_id = _plugin.group_index(sender).internal_id(group_id)
+    if internal_id is None:
+        raise Exception("id mismatch while adding group")
+
+    return { "id": group_id, "internal_id": internal_id, "sender": sender }
+
+# the raw JPEG bytes of the current webcam image
+def get_webcam_frame(_plugin):
+    capture = _plugin._capture
+    data = capture.frame_buffer.latest(2) if capture else None
+    if data is None:
+        data = _plugin.snapshots.get(_plugin.snapshot_url)
+    return data
+
+# every message gets its own attachment wrapping the shared snapshot bytes, only big ones spill to disk
+def get_webcam_snapshot(_plugin):
+    data = get_webcam_frame(_plugin)
+    with _plugin.metrics.time("snapshot_process"):
+        data = _plugin.snapshot_processor.process(data, _plugin.snapshot_options)
+    return Attachment.from_bytes(data, _plugin.attachment_spill_size, ".jpg")
+
+def close_attachments(attachments):
+    for attachment in attachments:
+        attachment.close()
+
+def close_captured(future):
+    if not future.cancelled() and future.result():
+        future.result().close()
+
+# the ffmpeg input for the last gif_duration seconds: frames from the capture buffer if we have them,
+# otherwise the live stream (which means waiting for the whole clip to be recorded)
+def get_webcam_video_input(_plugin):
+    capture = _plugin._capture
+    frames = capture.frame_buffer.frames(float(_plugin.gif_duration)) if capture else []
+    if len(frames) > 1:
+        _plugin._logger.debug("get_webcam_video_input: using [{}] buffered frames".format(len(frames)))
+        args = ["-f", "image2pipe", "-framerate", str(_plugin.frame_buffer_fps), "-c:v", "mjpeg", "-i", "-"]
+        return args, b"".join(frames)
+
+    return ["-t", str(_plugin.gif_duration), "-i", _plugin.stream_url], None
+
+# h264 needs even dimensions, hence scale_width=-2 for clips
+def get_webcam_video_filters(_plugin, scale_width=-1):
+    config = _plugin.config
+    flipH = config.flip_h
+    flipV = config.flip_v
+    rotate = config.rotate90
+
+    filter_complex = "fps={},scale={}:{}".format(_plugin.gif_framerate, scale_width, _plugin.gif_resolution.replace("p", ""))
 
-    raise Exception("id mismatch while adding group")
+    if flipV:
+        filter_complex = filter_complex + ",vflip"
+    if flipH:
+        filter_complex = filter_complex + ",hflip"
+    if rotate:
+            filter_complex = filter_complex + ",transpose=1"
 
-def get_webcam_snapshot(snapshot_url): 
-    filename, _ = urlretrieve(snapshot_url, tempfile.gettempdir()+"/snapshot.jpg")
-    return filename
+    return filter_complex
 
 # inspired by Octoprint Telegram
 # https://github.com/fabianonline/OctoPrint-Telegram
 def get_webcam_animated_gif(_plugin):
-    path = os.path.join(os.path.dirname(os.path.realpath(__file__)), "static", "gifcache")
-    if not os.path.exists(path): os.mkdir(path)
+    input_args, input_data = get_webcam_video_input(_plugin)
 
-    filename = "stream-" + str(time.time()) + ".gif"
-    fullpath = os.path.join(path, filename)
+    # ffmpeg -t 10 -y -threads 1 -i http://octopi-s1pro/webcam/?action=stream -filter_complex "fps=23,scale=-1:720" output.gif
+    args = [_plugin.ffmpeg_path, "-y", "-threads", "1"] + input_args + ["-filter_complex", get_webcam_video_filters(_plugin)]
 
-    flipH = _plugin._settings.global_get(["webcam", "flipH"])
-    flipV = _plugin._settings.global_get(["webcam", "flipV"])
-    rotate = _plugin._settings.global_get(["webcam", "rotate90"])
+    # write to stdout, the gif never has to touch the disk unless it is larger than the spill size
+    args.extend(["-f", "gif", "-"])
 
-    # ffmpeg -t 10 -y -threads 1 -i http://octopi-s1pro/webcam/?action=stream -filter_complex "fps=23,scale=-1:720" output.gif
-    args =  [
-                _plugin.ffmpeg_path, 
-                "-t", str(_plugin.gif_duration), 
-                "-y", 
-                "-threads", "1", 
-                "-i", _plugin.stream_url,
-                "-filter_complex"
-            ]
+    result = subprocess.run(args, input=input_data, stdout=subprocess.PIPE)
+    _plugin._logger.debug("get_webcam_animated_gif: returncode=[{}] size=[{}]".format(result.returncode, len(result.stdout)))
 
-    filter_complex = "fps={},scale=-1:{}".format(_plugin.gif_framerate, _plugin.gif_resolution.replace("p", ""))
+    if result.returncode == 0 and result.stdout:
+        return Attachment.from_bytes(result.stdout, _plugin.attachment_spill_size, ".gif")
+    
+    return None
 
-    if flipV:
-        filter_complex = filter_complex + ",vflip"
-    if flipH:
-        filter_complex = filter_complex + ",hflip"
-    if rotate:
-            filter_complex = filter_complex + ",transpose=1"
+# same input and filters as the gif, but encoded as h264 which is typically an order of magnitude smaller
+def get_webcam_clip(_plugin):
+    input_args, input_data = get_webcam_video_input(_plugin)
 
-    args.append(filter_complex)
-    args.append(fullpath)
+    args = [_plugin.ffmpeg_path, "-y"] + input_args
+    args.extend(["-filter_complex", get_webcam_video_filters(_plugin, scale_width=-2)])
+    # as an output option -threads limits the encoder
+    args.extend(["-threads", str(_plugin.clip_threads), "-an", "-c:v", "libx264", "-preset", "veryfast", "-pix_fmt", "yuv420p", "-crf", str(_plugin.clip_crf)])
 
-    result = subprocess.run(args)
-    _plugin._logger.debug("get_webcam_animated_gif: [{}]".format(result))
+    bitrate = _plugin.clip_bitrate
+    if bitrate:
+        args.extend(["-maxrate", bitrate, "-bufsize", bitrate])
+
+    # a fragmented mp4 can be written to a pipe, a regular one needs a seekable file
+    args.extend(["-movflags", "frag_keyframe+empty_moov+default_base_moof", "-f", "mp4", "-"])
+
+    result = subprocess.run(args, input=input_data, stdout=subprocess.PIPE)
+    _plugin._logger.debug("get_webcam_clip: returncode=[{}] size=[{}]".format(result.returncode, len(result.stdout)))
+
+    if result.returncode == 0 and result.stdout:
+        return Attachment.from_bytes(result.stdout, _plugin.attachment_spill_size, ".mp4")
 
-    if os.path.exists(fullpath):
-        return fullpath
-    
     return None
 
+# tags filled in from the cached printer state at render time, mapped to the plugin method providing them
+TAG_PROVIDERS = {
+    "state": "_provide_state_tags",
+    "tool_temp_actual": "_provide_temperature_tags",
+    "tool_temp_target": "_provide_temperature_tags",
+    "bed_temp_actual": "_provide_temperature_tags",
+    "bed_temp_target": "_provide_temperature_tags",
+    "chamber_temp_actual": "_provide_temperature_tags",
+    "chamber_temp_target": "_provide_temperature_tags"
+}
+
+TEMPLATE_SETTINGS = (
+    "printstartedeventtemplate",
+    "printdoneeventtemplate",
+    "printpausedeventtemplate",
+    "filamentchangeeventtemplate",
+    "printfailedeventtemplate",
+    "printcancelledeventtemplate",
+    "printresumedeventtemplate",
+    "sendprintprogresstemplate",
+    "statusreporttemplate"
+)
+
+# how often due messages are retried from the outbound journal, in seconds
+JOURNAL_REPLAY_INTERVAL = 15
+
+# seconds after which a typing indicator is sent again before the message
+TYPING_REFRESH = 10
+
+# how often the "every N minutes" progress cadence is checked, in seconds
+PROGRESS_TICK_INTERVAL = 15
+
 def get_supported_tags():
     return {
                 "filename": None,
@@ -366,10 +736,40 @@ class SignalclirestapiPlugin(octoprint.plugin.SettingsPlugin,
                              octoprint.plugin.ProgressPlugin):
 
     def __init__(self):
-        self._receiveThread = None
+        self._receive_threads = {}
+        self._dispatcher = None
+        self._clients = {}
+        self._sender_pool = None
+        self._fan_out = None
+        self._stages = None
+        self._coalescer = None
+        self._snapshots = None
+        self._snapshot_processor = None
+        self._capture = None
+        self._commands = None
+        self._rate_limiter = None
+        self._journal = None
+        self._journal_timer = None
+        self._groups = {}
+        self.seen_envelopes = RecentSet(512)
+        self._printer_state = PrinterStateCache()
+        self._progress = None
+        self._progress_timer = None
+        self._digest = None
+        self._digest_timer = None
+        self.metrics = Metrics()
+        self.metrics.gauge("threads", threading.active_count)
+        self.metrics.gauge("send_queue_depth", lambda: self._dispatcher.queue_depth if self._dispatcher else None)
+        self.metrics.gauge("send_workers_busy", lambda: self._dispatcher.stats()["busy"] if self._dispatcher else None)
+        self.metrics.gauge("commands_running", lambda: self._commands.running if self._commands else None)
+        self.metrics.gauge("journal_pending", lambda: self._journal.stats()["pending"] if self._journal else None)
+        self.metrics.gauge("frame_buffer_bytes", lambda: self._capture.frame_buffer.stats()["bytes"] if self._capture else None)
+        self.metrics.gauge("receive_connected", lambda: sum(int(thread.stats()["connected"]) for thread in list(self._receive_threads.values())))
+        self._client_lock = threading.Lock()
         self._group_id = None 
         self._printer_group_id = None
         self._supported_tags = get_supported_tags()
+        self._config = None
 
         self._settings_version = 2
     
@@ -378,6 +778,7 @@ class SignalclirestapiPlugin(octoprint.plugin.SettingsPlugin,
             enabled=False,
             url="http://127.0.0.1:8080",
             sendernr="",
+            additionalsendernrs="",
             recipientsnrs="",
             printstartedevent=True,
             printdoneevent=True,
@@ -395,6 +796,11 @@ class SignalclirestapiPlugin(octoprint.plugin.SettingsPlugin,
             printresumedeventtemplate="OctoPrint@{host}: {filename}: Job resumed!",
             attachsnapshots=False,
             groupsettings="none",
+            progresseveryminutes=0,
+            progresseverylayers=0,
+            digestenabled=False,
+            digestinterval=15,
+            digestframes=6,
             sendprintprogress=True,
             printergroupid={},
             progressintervals="20,40,60,80",
@@ -405,7 +811,55 @@ class SignalclirestapiPlugin(octoprint.plugin.SettingsPlugin,
             snapshotasgif=False,
             gifduration=5,
             gifframerate=10,
-            gifresolution="480p"
+            gifresolution="480p",
+            animationformat="gif",
+            clipcrf=28,
+            clipbitrate="",
+            clipthreads=1,
+            sendworkers=2,
+            sendqueuesize=20,
+            sendoverflowpolicy="dropoldestprogress",
+            httppoolsize=0,
+            httpconnecttimeout=5,
+            httpreadtimeout=30,
+            fanoutconcurrency=4,
+            snapshotcachettl=2,
+            attachmentspillsize=4096,
+            snapshotmaxdimension=0,
+            snapshotmaxsize=0,
+            snapshotquality=85,
+            framebufferenabled=False,
+            framebufferseconds=10,
+            framebufferfps=5,
+            framebuffersize=20480,
+            receiveheartbeat=30,
+            receivebackoffmin=2,
+            receivebackoffmax=60,
+            receivepollmin=1,
+            receivepollmax=30,
+            receivelongpoll=True,
+            commandworkers=2,
+            ratelimitenabled=True,
+            ratelimitsenderrate=30,
+            ratelimitsenderburst=10,
+            ratelimitrecipientrate=20,
+            ratelimitrecipientburst=10,
+            ratelimitreserve=2,
+            ratelimitlowwait=10,
+            journalenabled=True,
+            journalmaxentries=200,
+            journalmaxage=48,
+            journalmaxsize=50,
+            journalretrymin=30,
+            journalretrymax=1800,
+            commandtimeout=60,
+            commandsharewindow=10,
+            coalescewindows=dict(
+                job=0,
+                connection=0,
+                system=0,
+                progress=0
+            )
         ) 
 
     def get_settings_version(self):
@@ -430,153 +884,480 @@ class SignalclirestapiPlugin(octoprint.plugin.SettingsPlugin,
         self._settings.save()
         self._logger.info("Migrated to settings v%d from v%d", target, 1 if current == None else current)
 
+    def on_settings_initialized(self):
+        self._reload_config()
+
     def on_settings_save(self, data):
+        # reject broken templates here rather than failing every time they are rendered, the settings dialog
+        # is told so that it does not keep showing a template that was never saved
+        for key in TEMPLATE_SETTINGS:
+            if key in data:
+                try:
+                    MessageTemplate(data[key], self._supported_tags)
+                except TemplateError as e:
+                    self._logger.error("on_settings_save: keeping previous [{}]: {}".format(key, e))
+                    self._plugin_manager.send_plugin_message(self._identifier, dict(type="invalidtemplate", key=key, template=data[key], error=str(e)))
+                    del data[key]
+
         octoprint.plugin.SettingsPlugin.on_settings_save(self, data)
+        self._reload_config()
+
+        # the pooled http client is bound to url and sender
+        if ("url" in data or "sendernr" in data or "httppoolsize" in data or "httpconnecttimeout" in data or "httpreadtimeout" in data or
+                (self.config.http_pool_size <= 0 and ("fanoutconcurrency" in data or "sendworkers" in data))):
+            self._reset_client()
+
         # we need to clear out group data if a couple key settings have changed
         if "groupsettings" in data or "url" in data or "sendernr" in data or "recipientnrs" in data:
             self._settings.set(["printergroupid"], {})
             self._settings.save()
             self._printer_group_id = None
             self._group_id = None
-            self._receiveThread.restart()
+            with self._client_lock:
+                self._groups = {}
+            for thread in self._receive_threads.values():
+                thread.restart()
+
+        # one receive thread per sender account
+        if self._receive_threads and ("sendernr" in data or "additionalsendernrs" in data):
+            self._start_receive_threads()
+
+        if "framebufferenabled" in data or "framebufferseconds" in data or "framebufferfps" in data or "framebuffersize" in data or "attachsnapshots" in data or "gifduration" in data:
+            self._restart_capture()
+
+        if "commandworkers" in data or "commandtimeout" in data or "commandsharewindow" in data:
+            with self._client_lock:
+                commands = self._commands
+                self._commands = None
+            if commands: commands.shutdown()
+
+        if self._rate_limiter and any(key.startswith("ratelimit") for key in data):
+            config = self.config
+            self._rate_limiter.configure(config.rate_limit_sender_rate, config.rate_limit_sender_burst, config.rate_limit_recipient_rate,
+                                         config.rate_limit_recipient_burst, config.rate_limit_reserve, config.rate_limit_low_wait)
+
+        # limits apply to the open journal right away, only switching it off and on closes or opens one
+        if any(key.startswith("journal") for key in data):
+            config = self.config
+            if self._journal and config.journal_enabled:
+                self._journal.configure(config.journal_max_entries, config.journal_max_age, config.journal_max_size,
+                                        config.journal_retry_min, config.journal_retry_max)
+            else:
+                self._stop_journal()
+                if self._dispatcher: self._start_journal()
+
+        # a running job picks up the new cadence right away
+        if self._progress and ("progressintervals" in data or "progresseveryminutes" in data or "progresseverylayers" in data or
+                               "enabled" in data or "sendprintprogress" in data or any(key.startswith("digest") for key in data)):
+            self._start_progress(self._supported_tags["progress"])
+
+        if self._dispatcher and ("sendworkers" in data or "sendqueuesize" in data or "sendoverflowpolicy" in data):
+            self._dispatcher.configure(self.send_workers, self.send_queue_size, self.send_overflow_policy)
 
     @property
     def enabled(self):
-        return self._settings.get_boolean(["enabled"])
+        return self.config.enabled
 
     @property
     def notity_system_events(self):
-        return self._settings.get_boolean(["notitysystemevents"])
+        return self.config.notity_system_events
 
     @property
     def notity_connnection_events(self):
-        return self._settings.get_boolean(["notityconnnectionevents"])
+        return self.config.notity_connnection_events
 
     @property
     def url(self):
-        return self._settings.get(["url"])
+        return self.config.url
     
     @property
     def sender(self):
-        return self._settings.get(["sendernr"])
+        return self.config.sender
     
     @property
     def recipients(self):
-        return self._settings.get(["recipientnrs"]).split(",")
+        return list(self.config.recipients)
 
     @property
     def print_done_event(self):
-        return self._settings.get_boolean(["printdoneevent"])
+        return self.config.print_done_event
 
     @property
     def print_started_event(self):
-        return self._settings.get_boolean(["printstartedevent"])
+        return self.config.print_started_event
         
     @property
     def print_failed_event(self):
-        return self._settings.get_boolean(["printfailedevent"])
+        return self.config.print_failed_event
     
     @property
     def print_paused_event(self):
-        return self._settings.get_boolean(["printpausedevent"])
+        return self.config.print_paused_event
     
     @property
     def filament_change_event(self):
-        return self._settings.get_boolean(["filamentchangeevent"])
+        return self.config.filament_change_event
     
     @property
     def print_cancelled_event(self):
-        return self._settings.get_boolean(["printcancelledevent"])
+        return self.config.print_cancelled_event
 
     @property
     def print_resumed_event(self):
-        return self._settings.get_boolean(["printresumedevent"])
+        return self.config.print_resumed_event
 
     @property
     def create_group_for_every_print(self):
-        return self._settings.get(["groupsettings"]) == "job"
+        return self.config.create_group_for_every_print
 
     @property
     def create_group_by_printer(self):
-        return self._settings.get(["groupsettings"]) == "machine"
+        return self.config.create_group_by_printer
 
     @property
     def print_progress_intervals(self):
-        return self._settings.get(["progressintervals"]).split(",")
+        return self.config.progress_thresholds
 
     @property
     def attach_snapshots(self):
-        return self._settings.get_boolean(["attachsnapshots"])
+        return self.config.attach_snapshots
 
     @property
     def snapshot_url(self):
-        return self._settings.global_get(["webcam", "snapshot"])
+        return self.config.snapshot_url
     
+    @property
+    def snapshot_cache_ttl(self):
+        return self.config.snapshot_cache_ttl
+
+    @property
+    def attachment_spill_size(self):
+        return self.config.attachment_spill_kb * 1024
+
+    @property
+    def snapshot_processor(self):
+        with self._client_lock:
+            if self._snapshot_processor is None:
+                self._snapshot_processor = SnapshotProcessor(self._logger)
+                if not self._snapshot_processor.available:
+                    self._logger.warning("Pillow could not be imported, snapshots are sent as they come from the webcam")
+            return self._snapshot_processor
+
+    @property
+    def snapshot_options(self):
+        config = self.config
+        return SnapshotOptions(bool(config.flip_h), bool(config.flip_v), bool(config.rotate90), max(0, config.snapshot_max_dimension),
+                               max(0, config.snapshot_max_kb) * 1024, min(95, max(1, config.snapshot_quality)))
+
+    @property
+    def frame_buffer_enabled(self):
+        return self.config.frame_buffer_enabled
+
+    @property
+    def frame_buffer_seconds(self):
+        return self.config.frame_buffer_seconds
+
+    @property
+    def frame_buffer_fps(self):
+        return self.config.frame_buffer_fps
+
+    @property
+    def frame_buffer_size(self):
+        return self.config.frame_buffer_kb * 1024
+
+    def _restart_capture(self):
+        if self._capture:
+            self._capture.stop()
+            self._capture = None
+
+        if self.frame_buffer_enabled and self.attach_snapshots:
+            # keep at least enough frames around for a full gif
+            seconds = max(self.frame_buffer_seconds, float(self.gif_duration))
+            self._capture = MjpegCaptureThread(self._logger, self.stream_url, FrameBuffer(seconds, self.frame_buffer_size), self.frame_buffer_fps)
+            self._capture.start()
+
+    @property
+    def snapshots(self):
+        with self._client_lock:
+            if self._snapshots is None:
+                self._snapshots = SnapshotProvider(self._logger)
+            self._snapshots.ttl = self.snapshot_cache_ttl
+            return self._snapshots
+
     @property
     def snapshot_as_gif(self):
-        return self._settings.get_boolean(["snapshotasgif"])
+        return self.config.snapshot_as_gif
     
     @property
     def gif_duration(self):
-        return self._settings.get(["gifduration"])
+        return self.config.gif_duration
     
     @property
     def gif_framerate(self):
-        return self._settings.get(["gifframerate"])
+        return self.config.gif_framerate
     
     @property
     def gif_resolution(self):
-        return self._settings.get(["gifresolution"])
+        return self.config.gif_resolution
     
+    @property
+    def animation_format(self):
+        return self.config.animation_format
+
+    @property
+    def clip_crf(self):
+        return self.config.clip_crf
+
+    @property
+    def clip_bitrate(self):
+        return self.config.clip_bitrate
+
+    @property
+    def clip_threads(self):
+        return self.config.clip_threads
+
     @property
     def stream_url(self):
-        url = self._settings.global_get(["webcam", "stream"])
-        if not url.startswith("http"): url = "http://localhost" + url
-        return url
+        return self.config.stream_url
     
     @property
     def ffmpeg_path(self):
-        return self._settings.global_get(["webcam", "ffmpeg"])
+        return self.config.ffmpeg_path
     
+    @property
+    def send_workers(self):
+        return self.config.send_workers
+
+    @property
+    def send_queue_size(self):
+        return self.config.send_queue_size
+
+    @property
+    def send_overflow_policy(self):
+        return self.config.send_overflow_policy
+
+    # 0 sizes the pool for everything that may talk to one account at once: the fan-out, the stages of
+    # every send worker and the receive long-poll
+    @property
+    def http_pool_size(self):
+        if self.config.http_pool_size > 0:
+            return self.config.http_pool_size
+        return self.fan_out_concurrency + 2 * self.send_workers + 1
+
+    @property
+    def http_connect_timeout(self):
+        return self.config.http_connect_timeout
+
+    @property
+    def http_read_timeout(self):
+        return self.config.http_read_timeout
+
+    @property
+    def client(self):
+        return self.client_for(self.sender)
+
+    def client_for(self, sender):
+        with self._client_lock:
+            client = self._clients.get(sender)
+            if client is None:
+                client = self._clients[sender] = SignalRestClient(self.url, sender, self.http_pool_size, self.http_connect_timeout, self.http_read_timeout)
+            return client
+
+    @property
+    def sender_pool(self):
+        with self._client_lock:
+            senders = self.config.senders or (self.sender,)
+            if self._sender_pool is None or self._sender_pool.senders != senders:
+                self._sender_pool = SenderPool(self._logger, senders)
+            return self._sender_pool
+
+    def group_sender(self, recipient):
+        group = self._group_id
+        if group and group["id"] == recipient:
+            return group.get("sender") or self.sender
+        return None
+
+    def sender_for(self, recipient):
+        return self.group_sender(recipient) or self.sender_pool.pick(recipient)
+
+    # recipients grouped by the sender that sends to them, a job group always goes through the account that created it
+    def shards(self, recipients):
+        shards = {}
+        for recipient in recipients:
+            shards.setdefault(self.sender_for(recipient), []).append(recipient)
+        return shards
+
+    @property
+    def fan_out_concurrency(self):
+        return self.config.fan_out_concurrency
+
+    @property
+    def fan_out(self):
+        with self._client_lock:
+            if self._fan_out is None or self._fan_out.max_workers != self.fan_out_concurrency:
+                if self._fan_out: self._fan_out.retire()
+                self._fan_out = FanOut(self._logger, self.fan_out_concurrency, metrics=self.metrics)
+            return self._fan_out
+
+    # a message has at most two stages in the background (capture and typing indicator)
+    @property
+    def stages(self):
+        with self._client_lock:
+            if self._stages is None or self._stages.max_workers != 2 * self.send_workers:
+                if self._stages: self._stages.retire()
+                self._stages = FanOut(self._logger, 2 * self.send_workers, metrics=self.metrics)
+            return self._stages
+
+    @property
+    def commands(self):
+        with self._client_lock:
+            if self._commands is None:
+                self._commands = self._create_command_registry()
+            return self._commands
+
+    def _create_command_registry(self):
+        registry = CommandRegistry(self._logger, self.config.command_workers, self.config.command_timeout, self.config.command_share_window)
+        for command in get_builtin_commands():
+            registry.register(command)
+
+        # let other plugins add their own commands
+        for name, hook in self._plugin_manager.get_hooks(COMMANDS_HOOK).items():
+            try:
+                for command in hook(self) or []:
+                    registry.register(Command.from_hook(command))
+            except Exception as e:
+                self._logger.exception("_create_command_registry: error loading commands from [{}]: {}".format(name, e))
+
+        return registry
+
+    # a group only exists on the account of the pool that created it, each account has its own index
+    def group_index(self, sender):
+        with self._client_lock:
+            index = self._groups.get(sender)
+            if index is None:
+                name = "groups.json" if sender == self.sender else "groups-{}.json".format(re.sub(r"\W", "", sender))
+                path = os.path.join(self.get_plugin_data_folder(), name)
+                index = self._groups[sender] = GroupIndex(self._logger, path, sender, lambda: self.client_for(sender).list_groups())
+            return index
+
+    def is_current_group(self, internal_id):
+        group = self._group_id
+        if not group:
+            return False
+        return self.group_index(group.get("sender") or self.sender).internal_id(group["id"]) == internal_id
+
+    @property
+    def rate_limit_enabled(self):
+        return self.config.rate_limit_enabled
+
+    @property
+    def rate_limiter(self):
+        with self._client_lock:
+            if self._rate_limiter is None:
+                config = self.config
+                self._rate_limiter = RateLimiter(self._logger, config.rate_limit_sender_rate, config.rate_limit_sender_burst, config.rate_limit_recipient_rate,
+                                                 config.rate_limit_recipient_burst, config.rate_limit_reserve, config.rate_limit_low_wait)
+            return self._rate_limiter
+
+    def coalesce_window(self, event_class):
+        return self.config.coalesce_windows.get(event_class, 0)
+
+    def _reset_client(self):
+        with self._client_lock:
+            clients = self._clients
+            self._clients = {}
+        # in-flight requests keep their own reference, close() only drops idle connections
+        for client in clients.values():
+            client.close()
+
+    def _start_receive_threads(self):
+        senders = self.config.senders
+        for sender in list(self._receive_threads):
+            if sender not in senders:
+                self._receive_threads.pop(sender).shutdown()
+
+        for sender in senders:
+            if sender not in self._receive_threads:
+                thread = ReceiveThread(name="signalclirestapi-receive-{}".format(sender))
+                thread.daemon = True
+                thread.set_plugin(self, sender)
+                thread.start()
+                self._receive_threads[sender] = thread
+
+    def _stop_receive_threads(self):
+        threads = list(self._receive_threads.values())
+        self._receive_threads = {}
+        for thread in threads:
+            thread.shutdown()
+        for thread in threads:
+            thread.join(5)
+
     @property
     def send_print_progress(self):
-        return self._settings.get_boolean(["sendprintprogress"])
+        return self.config.send_print_progress
 
     @property
     def send_print_progress_template(self):
-        return self._settings.get(["sendprintprogresstemplate"])
+        return self.config.templates["sendprintprogresstemplate"]
 
     @property
     def print_started_event_template(self):
-        return self._settings.get(["printstartedeventtemplate"])
+        return self.config.templates["printstartedeventtemplate"]
 
     @property
     def print_paused_event_template(self):
-        return self._settings.get(["printpausedeventtemplate"])
+        return self.config.templates["printpausedeventtemplate"]
     
     @property
     def filament_change_event_template(self):
-        return self._settings.get(["filamentchangeeventtemplate"])
+        return self.config.templates["filamentchangeeventtemplate"]
 
     @property
     def print_cancelled_event_template(self):
-        return self._settings.get(["printcancelledeventtemplate"])
+        return self.config.templates["printcancelledeventtemplate"]
 
     @property
     def print_done_event_template(self):
-        return self._settings.get(["printdoneeventtemplate"])
+        return self.config.templates["printdoneeventtemplate"]
 
     @property
     def print_resumed_event_template(self):
-        return self._settings.get(["printresumedeventtemplate"])
+        return self.config.templates["printresumedeventtemplate"]
 
     @property
     def print_failed_event_template(self):
-        return self._settings.get(["printfailedeventtemplate"])
+        return self.config.templates["printfailedeventtemplate"]
 
     @property
     def send_status_report_template(self):
-        return self._settings.get(["statusreporttemplate"])
+        return self.config.templates["statusreporttemplate"]
+
+    @property
+    def config(self):
+        if self._config is None:
+            self._reload_config()
+        return self._config
+
+    def _reload_config(self):
+        self._config = PluginConfig.from_settings(self._settings, self._compile_templates(), self.get_settings_defaults())
+        self._logger.debug("_reload_config: configuration reloaded")
+
+    def _compile_templates(self):
+        defaults = self.get_settings_defaults()
+        templates = {}
+        for key in TEMPLATE_SETTINGS:
+            try:
+                templates[key] = MessageTemplate(self._settings.get([key]), self._supported_tags, TAG_PROVIDERS)
+            except TemplateError as e:
+                self._logger.error("_compile_templates: falling back to the default [{}]: {}".format(key, e))
+                templates[key] = MessageTemplate(defaults[key], self._supported_tags, TAG_PROVIDERS)
+        return templates
+
+    def _render(self, template, tags=None):
+        tags = self._supported_tags.copy() if tags is None else tags
+        for provider in template.providers:
+            getattr(self, provider)(tags)
+        return template.render(tags)
 
     def _create_group_if_not_exists(self):
         if self._group_id is None:
@@ -601,10 +1382,139 @@ class SignalclirestapiPlugin(octoprint.plugin.SettingsPlugin,
         except Exception as e:
             self._logger.exception("_create_printer_group_if_not_exists: Couldn't create signal group: {}".format(e))
 
-    def _send_message(self, message, snapshot=True, snapshot_as_gif=False):
-        # run on its own thread to prevent blocking of OctoPrint
-        self._logger.debug("_send_message: deferring message")
-        threading.Thread(target=defer_send_message, args=(self, message, snapshot, snapshot_as_gif)).start()
+    def _start_dispatcher(self):
+        if self._dispatcher is None:
+            self._dispatcher = SendDispatcher(self._logger, self.send_workers, self.send_queue_size, self.send_overflow_policy, metrics=self.metrics)
+            self._coalescer = Coalescer(self._logger, self._dispatch_message)
+        self._dispatcher.start()
+
+    def _send_message(self, message, snapshot=True, snapshot_as_gif=False, kind=KIND_EVENT, event=None):
+        if self._dispatcher is None:
+            self._start_dispatcher()
+
+        event_class = CLASS_PROGRESS if kind == KIND_PROGRESS else EVENT_CLASSES.get(event)
+        window = 0 if event in FLUSH_EVENTS else self.coalesce_window(event_class)
+        self._coalescer.add(message, snapshot, snapshot_as_gif, kind, window, urgent=event in BYPASS_EVENTS, priority=get_priority(kind, event))
+
+    def _dispatch_message(self, message, snapshot=True, snapshot_as_gif=False, kind=KIND_EVENT, priority=PRIORITY_NORMAL):
+        # progress ticks and replies are stale by the time they could be replayed, only events are journaled
+        journal = self._journal
+        journal_id = None
+        if journal and priority > PRIORITY_LOW:
+            try:
+                journal_id = journal.record(message, snapshot, snapshot_as_gif, kind, priority)
+            except Exception as e:
+                self._logger.exception("_dispatch_message: could not journal message: [{}]".format(e))
+
+        # hand off to the send workers to prevent blocking of OctoPrint
+        self._logger.debug("_dispatch_message: deferring [{}] message (queue depth [{}])".format(kind, self._dispatcher.queue_depth))
+        args = (self, message, snapshot, snapshot_as_gif, priority, journal_id, None, None, journal)
+        if not self._dispatcher.submit(defer_send_message, args, kind=kind, priority=priority) and journal_id is not None:
+            journal.failed(journal_id, "send queue full")
+
+    def _start_progress(self, progress=None):
+        self._stop_progress()
+        config = self.config
+        self._progress = ProgressScheduler(config.progress_thresholds, config.progress_every_minutes, config.progress_every_layers, progress)
+        if self._progress.timed:
+            self._progress_timer = octoprint.util.RepeatedTimer(PROGRESS_TICK_INTERVAL, self._progress_tick, daemon=True)
+            self._progress_timer.start()
+
+        # the digest only bundles progress updates, without them it would just capture frames for nothing
+        if config.digest_enabled and self.enabled and self.send_print_progress:
+            frames = config.digest_frames if self.attach_snapshots else 0
+            self._digest = ProgressDigest(config.digest_interval * 60, frames)
+            self._digest_timer = octoprint.util.RepeatedTimer(self._digest.tick_interval, self._digest_tick, daemon=True)
+            self._digest_timer.start()
+
+    # whatever the digest still holds goes out unless we are shutting down
+    def _stop_progress(self, flush=True):
+        if self._progress_timer:
+            self._progress_timer.cancel()
+            self._progress_timer = None
+        self._progress = None
+
+        if self._digest_timer:
+            self._digest_timer.cancel()
+            self._digest_timer = None
+        digest = self._digest
+        self._digest = None
+        if digest and flush:
+            self._send_digest(digest)
+
+    def _digest_tick(self):
+        digest = self._digest
+        if digest is None:
+            return
+        if digest.max_frames:
+            try:
+                digest.add_frame(get_webcam_frame(self))
+            except Exception as e:
+                self._logger.warning("_digest_tick: could not get webcam image: [{}]".format(e))
+        if digest.due():
+            self._send_digest(digest)
+
+    def _send_digest(self, digest):
+        lines, frames = digest.take()
+        # frames alone (e.g. while paused) are not worth a message
+        if not lines or not self.enabled:
+            return
+
+        message = "\n".join(datetime.fromtimestamp(timestamp).strftime("%H:%M") + " " + text for timestamp, text in lines)
+        if self._dispatcher is None:
+            self._start_dispatcher()
+        self._logger.debug("_send_digest: [{}] updates, [{}] frames".format(len(lines), len(frames)))
+        priority = get_priority(KIND_PROGRESS)
+        self._dispatcher.submit(send_digest, (self, message, frames, priority), kind=KIND_PROGRESS, priority=priority)
+
+    def _progress_tick(self):
+        scheduler = self._progress
+        if scheduler and self.enabled and self.send_print_progress and scheduler.on_tick():
+            self._send_progress()
+
+    def _send_progress(self):
+        message = self._render(self.send_print_progress_template)
+        digest = self._digest
+        if digest:
+            digest.add_line(message)
+            return
+        self._send_message(message, snapshot_as_gif=self.snapshot_as_gif, kind=KIND_PROGRESS)
+
+    def _start_journal(self):
+        if not self.config.journal_enabled or self._journal is not None:
+            return
+        config = self.config
+        try:
+            self._journal = OutboundJournal(self._logger, self.get_plugin_data_folder(), config.journal_max_entries, config.journal_max_age,
+                                            config.journal_max_size, config.journal_retry_min, config.journal_retry_max)
+        except Exception as e:
+            self._logger.exception("_start_journal: journal not available, messages will not survive restarts: [{}]".format(e))
+            return
+
+        self._journal_timer = octoprint.util.RepeatedTimer(JOURNAL_REPLAY_INTERVAL, self._replay_journal, daemon=True)
+        self._journal_timer.start()
+
+    def _stop_journal(self):
+        if self._journal_timer:
+            self._journal_timer.cancel()
+            self._journal_timer = None
+        if self._journal:
+            self._journal.close()
+            self._journal = None
+
+    def _replay_journal(self):
+        journal = self._journal
+        if journal is None:
+            return
+        try:
+            journal.compact()
+            for entry in journal.take_due():
+                self._logger.info("_replay_journal: retrying message [{}] (attempt [{}])".format(entry.id, entry.attempts + 1))
+                args = (self, entry.message, entry.snapshot, entry.snapshot_as_gif, entry.priority, entry.id, entry.attachments(), entry.recipients, journal)
+                if not self._dispatcher.submit(defer_send_message, args, kind=entry.kind, priority=entry.priority):
+                    journal.failed(entry.id, "send queue full")
+        except Exception as e:
+            self._logger.exception("_replay_journal: [{}]".format(e))
      
     def on_event(self, event, payload):
         # populate tags managed via event payload data
@@ -616,94 +1526,151 @@ class SignalclirestapiPlugin(octoprint.plugin.SettingsPlugin,
             if "reason" in payload:
                 self._supported_tags["reason"] = payload["reason"]
 
-        # populate tags managed elsewhere
-        self.update_supported_tags()
-
         # special cases for PRINT_STARTED, STARTUP, and SHUTDOWN
         if event == Events.PRINT_STARTED:
             self._supported_tags["progress"] = 0
+            self._start_progress()
             if self.create_group_for_every_print: self._group_id = None 
             if self.enabled and self.print_started_event:
-                message = self.print_started_event_template.format(**self._supported_tags) 
-                self._send_message(message) 
+                message = self._render(self.print_started_event_template) 
+                self._send_message(message, event=event) 
             return
         elif event == Events.STARTUP:
             self._printer_group_id = self._settings.get(["printergroupid"])
             if not self._printer_group_id: self._printer_group_id = None
 
-            self._receiveThread = ReceiveThread()
-            self._receiveThread.daemon = True
-            self._receiveThread.set_plugin(self)
-            self._receiveThread.start() 
+            self._start_dispatcher()
+            self._restart_capture()
+
+            # from now on OctoPrint pushes state and temperatures to us
+            try:
+                self._printer_state.refresh(self._printer)
+            except Exception as e:
+                self._logger.exception("on_event: could not read initial printer state: [{}]".format(e))
+            self._printer.register_callback(self._printer_state)
+
+            # pick up whatever could not be delivered before we went down
+            self._start_journal()
+            self._replay_journal()
+
+            self._start_receive_threads()
 
             if self.create_group_by_printer and self._printer_group_id:
                 self._group_id = self._printer_group_id
 
             if self.enabled and self.notity_system_events:
-                self._send_message("OctoPrint@{host}: Started".format(**self._supported_tags))
+                self._send_message("OctoPrint@{host}: Started".format(**self._supported_tags), event=event)
 
+            return
+        elif event == Events.SETTINGS_UPDATED:
+            # also covers OctoPrint's own webcam settings
+            self._reload_config()
             return
         elif event == Events.SHUTDOWN: 
             if self.enabled and self.notity_system_events:
-                self._send_message("OctoPrint@{host}: Shutting down".format(**self._supported_tags))        
-            self._receiveThread.shutdown()
-            self._receiveThread.join()
+                self._send_message("OctoPrint@{host}: Shutting down".format(**self._supported_tags), event=event)
+            if self._coalescer:
+                self._coalescer.flush()
+            self._stop_receive_threads()
+            self._printer.unregister_callback(self._printer_state)
+            if self._dispatcher:
+                self._dispatcher.shutdown(timeout=10)
+            self._stop_journal()
+            self._stop_progress(flush=False)
+            if self._fan_out:
+                self._fan_out.shutdown()
+            if self._stages:
+                self._stages.shutdown()
+            if self._commands:
+                self._commands.shutdown()
+            if self._capture:
+                self._capture.stop()
             self._logger.debug("shutdown complete")
             return
             
+        # keep the progress schedule in step with the job
+        scheduler = self._progress
+        if event in (Events.PRINT_DONE, Events.PRINT_FAILED, Events.PRINT_CANCELLED):
+            self._stop_progress()
+        elif event == Events.PRINT_PAUSED and scheduler:
+            scheduler.pause()
+        elif event == Events.PRINT_RESUMED and scheduler:
+            scheduler.resume()
+        elif event == LAYER_CHANGED_EVENT and scheduler and payload:
+            try:
+                layer = int(payload.get("currentLayer"))
+            except (TypeError, ValueError):
+                return
+            if self.enabled and self.send_print_progress and scheduler.on_layer(layer):
+                self._send_progress()
+            return
+
         # bail if notifications are not enabled
         if not self.enabled:
             return
 
         if event == Events.CONNECTED and self.notity_connnection_events:
-            self._send_message("OctoPrint@{host}: Connected".format(**self._supported_tags))
+            self._send_message("OctoPrint@{host}: Connected".format(**self._supported_tags), event=event)
         elif event == Events.DISCONNECTED and self.notity_connnection_events:
-            self._send_message("OctoPrint@{host}: Disconnected".format(**self._supported_tags))
+            self._send_message("OctoPrint@{host}: Disconnected".format(**self._supported_tags), event=event)
         elif event == Events.PRINT_DONE and self.print_done_event:
-            message = self.print_done_event_template.format(**self._supported_tags)
-            self._send_message(message)
+            message = self._render(self.print_done_event_template)
+            self._send_message(message, event=event)
         elif event == Events.PRINT_FAILED and self.print_failed_event:
-            message = self.print_failed_event_template.format(**self._supported_tags)
-            self._send_message(message)
+            message = self._render(self.print_failed_event_template)
+            self._send_message(message, event=event)
         elif event == Events.PRINT_CANCELLED and self.print_cancelled_event:
-            message = self.print_cancelled_event_template.format(**self._supported_tags)
-            self._send_message(message)
+            message = self._render(self.print_cancelled_event_template)
+            self._send_message(message, event=event)
         elif event == Events.PRINT_PAUSED and self.print_paused_event:
-            message = self.print_paused_event_template.format(**self._supported_tags)
-            self._send_message(message)
+            message = self._render(self.print_paused_event_template)
+            self._send_message(message, event=event)
         elif event == Events.FILAMENT_CHANGE and self.filament_change_event:
-            message = self.filament_change_event_template.format(**self._supported_tags)
-            self._send_message(message)
+            message = self._render(self.filament_change_event_template)
+            self._send_message(message, event=event)
         elif event == Events.PRINT_RESUMED and self.print_resumed_event:
-            message = self.print_resumed_event_template.format(**self._supported_tags)
-            self._send_message(message)
+            message = self._render(self.print_resumed_event_template)
+            self._send_message(message, event=event)
 
     def on_print_progress(self, storage, path, progress):
         if self.enabled and self.send_print_progress:
             self._supported_tags["progress"] = progress
             self._supported_tags["filename"] = path
 
-            # populate tags managed elsewhere
-            self.update_supported_tags()
+            # e.g. the plugin was enabled halfway through the job
+            if self._progress is None:
+                self._start_progress(progress)
 
-            if str(progress) in self.print_progress_intervals:
-                message = self.send_print_progress_template.format(**self._supported_tags)
-                self._send_message(message, snapshot_as_gif=self.snapshot_as_gif)
+            if self._progress.on_progress(progress):
+                self._send_progress()
 
     def on_demand_status_report(self):
         if self.enabled:
-            # populate tags managed elsewhere
-            self.update_supported_tags()
             tags = self._supported_tags.copy()
 
-            if self._printer.is_printing() or self._printer.is_paused() or self._printer.is_pausing():
+            if self._printer_state.snapshot.printing:
                 tags["progress"] = "{}%".format(self._supported_tags["progress"])
             else:
                 tags["filename"] = "*"
                 tags["progress"] = "*"
 
-            message = self.send_status_report_template.format(**tags)
-            self._send_message(message, snapshot_as_gif=self.snapshot_as_gif)
+            message = self._render(self.send_status_report_template, tags)
+            self._send_message(message, snapshot_as_gif=self.snapshot_as_gif, kind=KIND_REPLY)
+
+    # GET /api/plugin/signalclirestapi?format=prometheus for a scrape target
+    def on_api_get(self, request):
+        if request.values.get("format") == "prometheus":
+            return flask.Response(self.metrics.as_prometheus(), mimetype="text/plain; version=0.0.4")
+
+        return flask.jsonify(dict(
+            metrics=self.metrics.as_dict(),
+            dispatcher=self._dispatcher.stats() if self._dispatcher else None,
+            receive=dict((sender, thread.stats()) for sender, thread in self._receive_threads.items()),
+            senders=self._sender_pool.stats() if self._sender_pool else None,
+            commands=dict(running=self._commands.running) if self._commands else None,
+            ratelimit=self._rate_limiter.stats() if self._rate_limiter else None,
+            journal=self._journal.stats() if self._journal else None
+        ))
 
     def get_api_commands(self):
         return dict(testMessage=["sender", "recipients", "url"]);
@@ -727,43 +1694,34 @@ class SignalclirestapiPlugin(octoprint.plugin.SettingsPlugin,
                 return
 
             try:
-                snapshot_filenames = []
+                attachments = []
                 message = "Hello from OctoPrint"
                 if attach_snapshot:
-                    snapshot_url = self._settings.global_get(["webcam", "snapshot"])
                     try:
-                        snapshot_filenames.append(get_webcam_snapshot(snapshot_url))
+                        attachments.append(get_webcam_snapshot(self))
                     except Exception as e:
                         message = "Hello from OctoPrint.\nThere should be a webcam image attached, but your camera seems to be not working. Please check your camera!"
                         self._logger.exception("Sending test message. Couldn't get webcam image...sending without it")
 
-                send_message(url, sender_nr, message, recipients, snapshot_filenames)  
+                client = SignalRestClient(url, sender_nr, 1, self.http_connect_timeout, self.http_read_timeout)
+                try:
+                    send_message(client, message, recipients, attachments)
+                finally:
+                    client.close()
+                    close_attachments(attachments)
             except Exception as e:
                 return flask.jsonify(dict(success=False, msg=str(e)))
             
             return flask.jsonify(dict(success=False, msg="Success! Please check your phone."))
 
-    def update_supported_tags(self):
-        self._supported_tags["state"] = self._printer.get_state_string()
-
-        temps = self._printer.get_current_temperatures()
-        if temps:
-            if "tool0" in temps.keys():
-                self._supported_tags["tool_temp_actual"] = temps["tool0"]["actual"]
-                self._supported_tags["tool_temp_target"] = temps["tool0"]["target"]
-            if "bed" in temps.keys():
-                self._supported_tags["bed_temp_actual"] = temps["bed"]["actual"]
-                self._supported_tags["bed_temp_target"] = temps["bed"]["target"]
-            if "chamber" in temps.keys():
-                self._supported_tags["chamber_temp_actual"] = temps["chamber"]["actual"]
-                self._supported_tags["chamber_temp_target"] = temps["chamber"]["target"]
-        else:
-                self._supported_tags["tool_temp_actual"] = "*"
-                self._supported_tags["tool_temp_target"] = "*"
-                self._supported_tags["bed_temp_actual"] = "*"
-                self._supported_tags["bed_temp_target"] = "*"
-                self._supported_tags["chamber_temp_actual"] = "*"
-                self._supported_tags["chamber_temp_target"] = "*"
+    # ~~ tag providers, only called for templates referencing their tags
+
+    # both read the state OctoPrint last pushed to us, never the printer itself
+    def _provide_state_tags(self, tags):
+        self._printer_state.state_tags(tags)
+
+    def _provide_temperature_tags(self, tags):
+        self._printer_state.temperature_tags(tags)
 
 
     def get_template_configs(self):
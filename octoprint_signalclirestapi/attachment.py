@@ -0,0 +1,61 @@
+# coding=utf-8
+from __future__ import absolute_import
+
+import base64
+import os
+import tempfile
+
+# multiple of 3 so that consecutive base64 chunks can simply be concatenated
+CHUNK_SIZE = 3 * 16 * 1024
+
+# Captured media kept in memory and streamed as base64 straight into the REST request body.
+# Anything larger than spill_size bytes is written to a temp file first so a long clip does not
+# sit in RAM while it is being sent. Reading is re-entrant, the same attachment can be sent to
+# several recipients in parallel.
+class Attachment(object):
+    def __init__(self, data=None, filename=None, owned=False, suffix=None):
+        self._data = data
+        self._filename = filename
+        self._owned = owned
+        self.suffix = suffix if suffix is not None else os.path.splitext(filename or "")[1]
+
+    @classmethod
+    def from_bytes(cls, data, spill_size=None, suffix=""):
+        if spill_size is not None and len(data) > spill_size:
+            fd, filename = tempfile.mkstemp(prefix="signalclirestapi-", suffix=suffix)
+            with os.fdopen(fd, "wb") as f:
+                f.write(data)
+            return cls(filename=filename, owned=True)
+        return cls(data=data, suffix=suffix)
+
+    @property
+    def size(self):
+        if self._data is not None:
+            return len(self._data)
+        return os.path.getsize(self._filename)
+
+    @property
+    def base64_size(self):
+        return 4 * ((self.size + 2) // 3)
+
+    def chunks(self, size=CHUNK_SIZE):
+        if self._data is not None:
+            for offset in range(0, len(self._data), size):
+                yield self._data[offset:offset + size]
+        else:
+            with open(self._filename, "rb") as f:
+                while True:
+                    chunk = f.read(size)
+                    if not chunk:
+                        break
+                    yield chunk
+
+    def base64_chunks(self):
+        for chunk in self.chunks():
+            yield base64.b64encode(chunk)
+
+    def close(self):
+        self._data = None
+        if self._owned and self._filename and os.path.exists(self._filename):
+            os.remove(self._filename)
+        self._filename = None
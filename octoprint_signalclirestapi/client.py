@@ -0,0 +1,151 @@
+# coding=utf-8
+from __future__ import absolute_import
+
+import json
+import math
+import threading
+
+import requests
+from requests.adapters import HTTPAdapter
+from pysignalclirestapi import SignalCliRestApiError
+
+# Drop-in replacement for the parts of pysignalclirestapi.SignalCliRestApi we use.
+#
+# pysignalclirestapi goes through the module level requests functions, so every call
+# (plus an extra GET /v1/about per send) pays for a fresh TCP handshake. This client keeps
+# a requests.Session with a keep-alive connection pool around for the lifetime of the
+# (url, sender) pair and caches the about information. The pool should hold a connection for every
+# thread that may use the client at once, requests beyond it get a connection that is thrown away after.
+class SignalRestClient(object):
+    def __init__(self, url, sender, pool_size=4, connect_timeout=5, read_timeout=30):
+        self.url = url
+        self.sender = sender
+        self.timeout = (connect_timeout, read_timeout)
+
+        self._about = None
+        self._lock = threading.Lock()
+
+        self._session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=max(1, int(pool_size)))
+        self._session.mount("http://", adapter)
+        self._session.mount("https://", adapter)
+
+    def close(self):
+        self._session.close()
+
+    def _request(self, method, path, timeout=None, **kwargs):
+        try:
+            return self._session.request(method, self.url + path, timeout=timeout or self.timeout, **kwargs)
+        except requests.exceptions.ConnectionError:
+            # the container might have been upgraded in the meantime
+            self._about = None
+            raise
+
+    def about(self):
+        with self._lock:
+            if self._about is None:
+                resp = self._request("GET", "/v1/about")
+                if resp.status_code == 404:
+                    self._about = {"versions": ["v1"], "build": 1}
+                else:
+                    self._about = json.loads(resp.content)
+            return self._about
+
+    def mode(self):
+        return self.about().get("mode", "unknown")
+
+    def api_versions(self):
+        return self.about().get("versions", ["v1"])
+
+    def send_message(self, message, recipients, attachments=None, timeout=None):
+        api_versions = self.api_versions()
+        attachments = attachments or []
+        if len(attachments) > 1 and "v2" not in api_versions:
+            raise SignalCliRestApiError("This signal-cli-rest-api version is not capable of sending multiple attachments. Please upgrade your signal-cli-rest-api docker container!")
+
+        data = {
+            "message": message,
+            "number": self.sender,
+            "recipients": recipients
+        }
+
+        try:
+            if "v2" in api_versions:
+                path = "/v2/send"
+                body = StreamingJsonBody(data, "base64_attachments", attachments)
+            else:
+                path = "/v1/send"
+                body = StreamingJsonBody(data, "base64_attachment", attachments, as_list=False)
+
+            resp = self._request("POST", path, data=body, headers={"Content-Type": "application/json"}, timeout=timeout)
+            if resp.status_code != 201:
+                raise_response_error(resp, "Unknown error while sending signal message")
+        except SignalCliRestApiError:
+            raise
+        except Exception as e:
+            raise SignalCliRestApiError("Couldn't send signal message: {}".format(e))
+
+    def create_group(self, name, members):
+        resp = self._request("POST", "/v1/groups/" + self.sender, json={"members": members, "name": name})
+        if resp.status_code != 201 and resp.status_code != 200:
+            raise_response_error(resp, "Unknown error while creating Signal Messenger group")
+        return resp.json()["id"]
+
+    def list_groups(self):
+        resp = self._request("GET", "/v1/groups/" + self.sender)
+        if resp.status_code != 200:
+            raise_response_error(resp, "Unknown error while listing Signal Messenger groups")
+        return resp.json()
+
+    # wait asks signal-cli to long poll for up to that many seconds
+    def receive(self, wait=None):
+        params = None
+        timeout = None
+        if wait:
+            params = {"timeout": int(math.ceil(wait))}
+            timeout = (self.timeout[0], self.timeout[1] + wait)
+        resp = self._request("GET", "/v1/receive/" + self.sender, timeout=timeout, params=params)
+        if resp.status_code != 200:
+            raise_response_error(resp, "Unknown error while receiving Signal Messenger data")
+        return resp.json()
+
+    def typing_indicator(self, recipient, typing=True):
+        self._request("PUT" if typing else "DELETE", "/v1/typing-indicator/" + self.sender, json={"recipient": recipient})
+
+# JSON request body with the attachments base64 encoded on the fly while it is being sent.
+# The encoded size is known upfront, so requests sends a plain Content-Length body instead of
+# a chunked one.
+class StreamingJsonBody(object):
+    def __init__(self, data, key, attachments, as_list=True):
+        self._attachments = attachments if as_list else attachments[:1]
+        self._as_list = as_list
+
+        if not self._attachments and not as_list:
+            self._head = json.dumps(data).encode("utf-8")
+            self._tail = b""
+        else:
+            self._head = (json.dumps(data)[:-1] + ", " + json.dumps(key) + ": " + ("[" if as_list else "")).encode("utf-8")
+            self._tail = b"]}" if as_list else b"}"
+
+    def __len__(self):
+        # quotes around and commas between the attachments
+        separators = 3 * len(self._attachments) - 1 if self._attachments else 0
+        return len(self._head) + sum(attachment.base64_size for attachment in self._attachments) + separators + len(self._tail)
+
+    def __iter__(self):
+        yield self._head
+        for i, attachment in enumerate(self._attachments):
+            yield b',"' if i > 0 else b'"'
+            for chunk in attachment.base64_chunks():
+                yield chunk
+            yield b'"'
+        yield self._tail
+
+def raise_response_error(resp, default):
+    try:
+        json_resp = resp.json()
+    except ValueError:
+        json_resp = {}
+    if "error" in json_resp:
+        raise SignalCliRestApiError(json_resp["error"])
+    raise SignalCliRestApiError(default)
@@ -0,0 +1,125 @@
+# coding=utf-8
+from __future__ import absolute_import
+
+import threading
+import time
+
+from octoprint.events import Events
+
+from .dispatcher import KIND_EVENT, KIND_PROGRESS, KIND_REPLY
+from .ratelimit import PRIORITY_LOW, PRIORITY_NORMAL, PRIORITY_HIGH
+
+# event classes with their own coalescing window (see the coalescewindows setting)
+CLASS_JOB = "job"
+CLASS_CONNECTION = "connection"
+CLASS_SYSTEM = "system"
+CLASS_PROGRESS = "progress"
+
+EVENT_CLASSES = {
+    Events.PRINT_STARTED: CLASS_JOB,
+    Events.PRINT_DONE: CLASS_JOB,
+    Events.PRINT_FAILED: CLASS_JOB,
+    Events.PRINT_CANCELLED: CLASS_JOB,
+    Events.PRINT_PAUSED: CLASS_JOB,
+    Events.PRINT_RESUMED: CLASS_JOB,
+    Events.FILAMENT_CHANGE: CLASS_JOB,
+    Events.CONNECTED: CLASS_CONNECTION,
+    Events.DISCONNECTED: CLASS_CONNECTION,
+    Events.STARTUP: CLASS_SYSTEM,
+    Events.SHUTDOWN: CLASS_SYSTEM
+}
+
+# these get through even when the rate limit budget is tight
+HIGH_PRIORITY_EVENTS = (Events.PRINT_FAILED, Events.PRINT_CANCELLED, Events.FILAMENT_CHANGE)
+
+# these never wait for the window to close and go out as a message of their own
+BYPASS_EVENTS = (Events.PRINT_FAILED,)
+
+# these join the pending batch but close the window right away, e.g. a pause and the filament change after it
+FLUSH_EVENTS = (Events.PRINT_CANCELLED, Events.FILAMENT_CHANGE)
+
+def get_priority(kind, event=None):
+    if event in HIGH_PRIORITY_EVENTS:
+        return PRIORITY_HIGH
+    if kind == KIND_PROGRESS or kind == KIND_REPLY:
+        return PRIORITY_LOW
+    return PRIORITY_NORMAL
+
+# when messages are merged the most important kind wins
+KIND_RANK = {KIND_PROGRESS: 0, KIND_REPLY: 1, KIND_EVENT: 2}
+
+# Merges messages rendered within a short window into one multi-line message with a single attachment.
+#
+# The first message opens a batch that is flushed once its window elapses; later messages join the batch
+# and may only pull the deadline closer. A message without a window flushes the pending batch right away,
+# itself included. A bypass event flushes the pending batch too but goes out as a message of its own.
+class Coalescer(object):
+    def __init__(self, logger, send):
+        self._logger = logger
+        self._send = send
+        self._lock = threading.Lock()
+        self._batch = []
+        self._deadline = None
+        self._timer = None
+
+    def add(self, message, snapshot, snapshot_as_gif, kind, window_ms, urgent=False, priority=PRIORITY_NORMAL):
+        item = (message, snapshot, snapshot_as_gif, kind, priority)
+        if urgent:
+            with self._lock:
+                batch = self._take()
+            if batch:
+                self._flush(batch)
+            self._flush([item])
+            return
+
+        with self._lock:
+            self._batch.append(item)
+
+            if window_ms <= 0:
+                batch = self._take()
+            else:
+                deadline = time.time() + window_ms / 1000.0
+                if self._deadline is None or deadline < self._deadline:
+                    self._deadline = deadline
+                    self._schedule()
+                batch = None
+
+        if batch:
+            self._flush(batch)
+
+    def flush(self):
+        with self._lock:
+            batch = self._take()
+        if batch:
+            self._flush(batch)
+
+    # must be called with the lock held
+    def _take(self):
+        batch = self._batch
+        self._batch = []
+        self._deadline = None
+        if self._timer:
+            self._timer.cancel()
+            self._timer = None
+        return batch
+
+    # must be called with the lock held
+    def _schedule(self):
+        if self._timer:
+            self._timer.cancel()
+        self._timer = threading.Timer(max(0, self._deadline - time.time()), self.flush)
+        self._timer.daemon = True
+        self._timer.start()
+
+    def _flush(self, batch):
+        if len(batch) > 1:
+            self._logger.debug("Coalescer: merging [{}] messages".format(len(batch)))
+
+        message = "\n".join(item[0] for item in batch)
+        snapshot = any(item[1] for item in batch)
+        # only animate if every merged message asked for it, a still is the safe common denominator
+        snapshot_as_gif = all(item[2] for item in batch if item[1]) if snapshot else False
+        kind = max((item[3] for item in batch), key=lambda k: KIND_RANK.get(k, 0))
+        priority = max(item[4] for item in batch)
+
+        self._send(message, snapshot, snapshot_as_gif, kind, priority)
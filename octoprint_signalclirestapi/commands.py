@@ -0,0 +1,151 @@
+# coding=utf-8
+from __future__ import absolute_import
+
+import collections
+import concurrent.futures
+import subprocess
+import threading
+import time
+
+# Other plugins can add commands through this hook. The handler is called with the plugin instance and
+# must return a list of Command instances (or dicts with the same keys):
+#
+#     def get_signal_commands(signal_plugin):
+#         return [dict(name="lights", usage="lights on|off", description="toggle the enclosure lights",
+#                      handler=lambda plugin, ctx: toggle(ctx.args), slow=True, timeout=10)]
+#
+#     __plugin_hooks__ = {"octoprint.plugin.signalclirestapi.commands": get_signal_commands}
+COMMANDS_HOOK = "octoprint.plugin.signalclirestapi.commands"
+
+# what a handler gets to see about the inbound message, args is everything after the command word
+CommandContext = collections.namedtuple("CommandContext", ["name", "args", "message", "source", "group", "timeout"])
+
+class Command(object):
+    def __init__(self, name, handler, usage=None, description="", slow=False, timeout=None, read_only=False):
+        self.name = name.upper()
+        self.handler = handler
+        self.usage = usage or name.lower()
+        self.description = description
+        # slow commands run on the command executor so the receive loop keeps draining the socket
+        self.slow = slow
+        self.timeout = timeout
+        self.read_only = read_only
+
+    @classmethod
+    def from_hook(cls, value):
+        if isinstance(value, Command):
+            return value
+        return cls(**value)
+
+# Read-only commands (e.g. STATUS) answer the whole group, so an identical one arriving within share_window
+# seconds is served by the response already on its way instead of being computed again.
+class CommandRegistry(object):
+    def __init__(self, logger, workers=2, default_timeout=60, share_window=10):
+        self._logger = logger
+        self._commands = collections.OrderedDict()
+        self._recent = {}
+        self.share_window = share_window
+        self._executor = concurrent.futures.ThreadPoolExecutor(max_workers=max(1, int(workers)))
+        self._running = 0
+        self._lock = threading.Lock()
+        self.default_timeout = default_timeout
+
+    def register(self, command):
+        if command.name in self._commands:
+            self._logger.info("CommandRegistry: overriding command [{}]".format(command.name))
+        self._commands[command.name] = command
+
+    def get(self, name):
+        return self._commands.get(name.upper())
+
+    def shutdown(self):
+        self._executor.shutdown(wait=False)
+
+    def help_message(self):
+        lines = ["I respond to a number of different commands:\n"]
+        for command in self._commands.values():
+            lines.append("\t{}\t\t{}".format(command.usage, command.description))
+        return "\n".join(lines)
+
+    @property
+    def running(self):
+        return self._running
+
+    # returns False if we do not know the command
+    def dispatch(self, plugin, message, source=None, group=None):
+        name = message.split(" ")[0]
+        command = self.get(name)
+        if command is None:
+            return False
+
+        ctx = CommandContext(command.name, message[len(name):].strip(), message, source, group, command.timeout or self.default_timeout)
+        if command.read_only and self._shared(ctx):
+            self._logger.debug("CommandRegistry: [{}] from [{}] shares the response already in flight".format(ctx.name, source))
+            return True
+
+        if command.slow:
+            future = self._executor.submit(self._run, command, plugin, ctx)
+            watchdog = threading.Timer(ctx.timeout, self._timed_out, args=(future, ctx))
+            watchdog.daemon = True
+            watchdog.start()
+            future.add_done_callback(lambda _: watchdog.cancel())
+        else:
+            self._run(command, plugin, ctx)
+        return True
+
+    def _shared(self, ctx):
+        key = (ctx.name, ctx.args, ctx.group)
+        now = time.time()
+        with self._lock:
+            last = self._recent.get(key)
+            if last is not None and now - last < self.share_window:
+                return True
+            self._recent = dict((k, t) for k, t in self._recent.items() if now - t < self.share_window)
+            self._recent[key] = now
+            return False
+
+    def _run(self, command, plugin, ctx):
+        with self._lock:
+            self._running += 1
+        start = time.time()
+        try:
+            command.handler(plugin, ctx)
+        except Exception as e:
+            self._logger.exception("CommandRegistry: [{}] failed: [{}]".format(ctx.name, e))
+        finally:
+            with self._lock:
+                self._running -= 1
+            self._logger.debug("CommandRegistry: [{}] took [{:.3f}s]".format(ctx.name, time.time() - start))
+
+    def _timed_out(self, future, ctx):
+        # python threads cannot be killed, subprocess based handlers enforce ctx.timeout themselves
+        if not future.done():
+            self._logger.warning("CommandRegistry: [{}] still running after [{}s]".format(ctx.name, ctx.timeout))
+
+def run_shell(cmd, ctx):
+    subprocess.call(cmd, shell=True, timeout=ctx.timeout)
+
+def _set_temperature(heater):
+    return lambda plugin, ctx: plugin._printer.set_temperature(heater, float(ctx.args))
+
+def _server_command(key):
+    return lambda plugin, ctx: run_shell(plugin._settings.global_get(["server", "commands", key]), ctx)
+
+def get_builtin_commands():
+    return [
+        Command("status", lambda plugin, ctx: plugin.on_demand_status_report(), description="machine / job status", read_only=True),
+        Command("pause", lambda plugin, ctx: plugin._printer.pause_print(), description="pause current job"),
+        Command("resume", lambda plugin, ctx: plugin._printer.resume_print(), description="resume current job"),
+        Command("cancel", lambda plugin, ctx: plugin._printer.cancel_print(), description="cancel current job"),
+        Command("gcode", lambda plugin, ctx: plugin._printer.commands(ctx.args), usage="gcode ###", description="send gcode"),
+        Command("tool", _set_temperature("tool0"), usage="tool ###", description="tool temperature"),
+        Command("bed", _set_temperature("bed"), usage="bed ###", description="bed temperature"),
+        Command("chamber", _set_temperature("chamber"), usage="chamber ###", description="chamber temperature"),
+        Command("connect", lambda plugin, ctx: plugin._printer.connect(), description="connect to machine", slow=True),
+        Command("disconnect", lambda plugin, ctx: plugin._printer.disconnect(), description="disconnect machine"),
+        Command("shell", lambda plugin, ctx: run_shell(ctx.args, ctx), usage="shell ###", description="execute command", slow=True),
+        Command("stop", lambda plugin, ctx: run_shell("sudo service octoprint stop", ctx), description="stops Octoprint", slow=True),
+        Command("restart", _server_command("serverRestartCommand"), description="restarts Octoprint", slow=True),
+        Command("shutdown", _server_command("systemShutdownCommand"), description="shutdown our server", slow=True),
+        Command("reboot", _server_command("systemRestartCommand"), description="reboot our server", slow=True)
+    ]
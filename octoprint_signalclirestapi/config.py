@@ -0,0 +1,175 @@
+# coding=utf-8
+from __future__ import absolute_import
+
+import collections
+
+# plugin settings as (field, settings key, type)
+PLUGIN_SETTINGS = (
+    ("enabled", "enabled", bool),
+    ("notity_system_events", "notitysystemevents", bool),
+    ("notity_connnection_events", "notityconnnectionevents", bool),
+    ("url", "url", str),
+    ("sender", "sendernr", str),
+    ("print_done_event", "printdoneevent", bool),
+    ("print_started_event", "printstartedevent", bool),
+    ("print_failed_event", "printfailedevent", bool),
+    ("print_paused_event", "printpausedevent", bool),
+    ("filament_change_event", "filamentchangeevent", bool),
+    ("print_cancelled_event", "printcancelledevent", bool),
+    ("print_resumed_event", "printresumedevent", bool),
+    ("group_settings", "groupsettings", str),
+    ("send_print_progress", "sendprintprogress", bool),
+    ("progress_every_minutes", "progresseveryminutes", float),
+    ("progress_every_layers", "progresseverylayers", int),
+    ("digest_enabled", "digestenabled", bool),
+    ("digest_interval", "digestinterval", float),
+    ("digest_frames", "digestframes", int),
+    ("attach_snapshots", "attachsnapshots", bool),
+    ("snapshot_as_gif", "snapshotasgif", bool),
+    ("gif_duration", "gifduration", float),
+    ("gif_framerate", "gifframerate", float),
+    ("gif_resolution", "gifresolution", str),
+    ("animation_format", "animationformat", str),
+    ("clip_crf", "clipcrf", int),
+    ("clip_bitrate", "clipbitrate", str),
+    ("clip_threads", "clipthreads", int),
+    ("send_workers", "sendworkers", int),
+    ("send_queue_size", "sendqueuesize", int),
+    ("send_overflow_policy", "sendoverflowpolicy", str),
+    ("http_pool_size", "httppoolsize", int),
+    ("http_connect_timeout", "httpconnecttimeout", float),
+    ("http_read_timeout", "httpreadtimeout", float),
+    ("fan_out_concurrency", "fanoutconcurrency", int),
+    ("snapshot_cache_ttl", "snapshotcachettl", float),
+    ("attachment_spill_kb", "attachmentspillsize", int),
+    ("snapshot_max_dimension", "snapshotmaxdimension", int),
+    ("snapshot_max_kb", "snapshotmaxsize", int),
+    ("snapshot_quality", "snapshotquality", int),
+    ("frame_buffer_enabled", "framebufferenabled", bool),
+    ("frame_buffer_seconds", "framebufferseconds", float),
+    ("frame_buffer_fps", "framebufferfps", float),
+    ("frame_buffer_kb", "framebuffersize", int),
+    ("receive_heartbeat", "receiveheartbeat", float),
+    ("receive_backoff_min", "receivebackoffmin", float),
+    ("receive_backoff_max", "receivebackoffmax", float),
+    ("receive_poll_min", "receivepollmin", float),
+    ("receive_poll_max", "receivepollmax", float),
+    ("receive_long_poll", "receivelongpoll", bool),
+    ("command_workers", "commandworkers", int),
+    ("command_timeout", "commandtimeout", float),
+    ("command_share_window", "commandsharewindow", float),
+    ("rate_limit_enabled", "ratelimitenabled", bool),
+    ("rate_limit_sender_rate", "ratelimitsenderrate", float),
+    ("rate_limit_sender_burst", "ratelimitsenderburst", int),
+    ("rate_limit_recipient_rate", "ratelimitrecipientrate", float),
+    ("rate_limit_recipient_burst", "ratelimitrecipientburst", int),
+    ("rate_limit_reserve", "ratelimitreserve", int),
+    ("rate_limit_low_wait", "ratelimitlowwait", float),
+    ("journal_enabled", "journalenabled", bool),
+    ("journal_max_entries", "journalmaxentries", int),
+    ("journal_max_age", "journalmaxage", float),
+    ("journal_max_size", "journalmaxsize", float),
+    ("journal_retry_min", "journalretrymin", float),
+    ("journal_retry_max", "journalretrymax", float)
+)
+
+# lower bounds of numeric fields, a long poll with a wait of 0 would spin against the REST API
+MINIMUMS = {
+    "receive_poll_min": 1,
+    "receive_poll_max": 1
+}
+
+# OctoPrint's own webcam settings as (field, settings path)
+GLOBAL_SETTINGS = (
+    ("snapshot_url", ["webcam", "snapshot"]),
+    ("stream_path", ["webcam", "stream"]),
+    ("ffmpeg_path", ["webcam", "ffmpeg"]),
+    ("flip_h", ["webcam", "flipH"]),
+    ("flip_v", ["webcam", "flipV"]),
+    ("rotate90", ["webcam", "rotate90"])
+)
+
+DERIVED_FIELDS = (
+    "recipients",
+    "senders",
+    "allowed_senders",
+    "progress_thresholds",
+    "coalesce_windows",
+    "templates"
+)
+
+_PluginConfig = collections.namedtuple("_PluginConfig", [f[0] for f in PLUGIN_SETTINGS] + [f[0] for f in GLOBAL_SETTINGS] + list(DERIVED_FIELDS))
+
+# Immutable snapshot of all settings the plugin reads, built once whenever the settings change and swapped
+# in as a whole. Readers just grab plugin.config, so hot paths never hit the settings layer or need a lock.
+class PluginConfig(_PluginConfig):
+    __slots__ = ()
+
+    # a blank or invalid value (easily left behind in the text inputs) falls back to its default
+    @classmethod
+    def from_settings(cls, settings, templates, defaults=None):
+        defaults = defaults or {}
+        values = {}
+        for field, key, kind in PLUGIN_SETTINGS:
+            if kind is bool:
+                values[field] = bool(settings.get_boolean([key]))
+            else:
+                value = _convert(settings.get([key]), kind)
+                if value is None and kind is not str:
+                    value = _convert(defaults.get(key), kind)
+                if value is not None and field in MINIMUMS:
+                    value = max(MINIMUMS[field], value)
+                values[field] = value
+
+        for field, path in GLOBAL_SETTINGS:
+            values[field] = settings.global_get(path)
+
+        recipients = tuple(r.strip() for r in (settings.get(["recipientnrs"]) or "").split(",") if r.strip())
+        values["recipients"] = recipients
+        values["allowed_senders"] = frozenset(recipients)
+
+        # the configured sender first, duplicates and blanks dropped
+        senders = []
+        for sender in [values["sender"]] + (settings.get(["additionalsendernrs"]) or "").split(","):
+            sender = (sender or "").strip()
+            if sender and sender not in senders:
+                senders.append(sender)
+        values["senders"] = tuple(senders)
+        values["progress_thresholds"] = parse_thresholds(settings.get(["progressintervals"]))
+        values["coalesce_windows"] = dict((k, _convert(v, int) or 0) for k, v in (settings.get(["coalescewindows"]) or {}).items())
+        values["templates"] = dict(templates)
+
+        return cls(**values)
+
+    @property
+    def create_group_for_every_print(self):
+        return self.group_settings == "job"
+
+    @property
+    def create_group_by_printer(self):
+        return self.group_settings == "machine"
+
+    @property
+    def stream_url(self):
+        url = self.stream_path or ""
+        if not url.startswith("http"): url = "http://localhost" + url
+        return url
+
+def parse_thresholds(value):
+    thresholds = set()
+    for item in (value or "").split(","):
+        try:
+            thresholds.add(int(float(item)))
+        except ValueError:
+            pass
+    return tuple(sorted(thresholds))
+
+def _convert(value, kind):
+    if value is None or kind is str:
+        return value
+    try:
+        if kind is int:
+            return int(float(value))
+        return kind(value)
+    except (TypeError, ValueError):
+        return None
@@ -0,0 +1,26 @@
+# coding=utf-8
+from __future__ import absolute_import
+
+import collections
+import threading
+
+# Bounded set of recently seen keys, the least recently seen one is evicted first.
+class RecentSet(object):
+    def __init__(self, max_size=512):
+        self._lock = threading.Lock()
+        self._keys = collections.OrderedDict()
+        self.max_size = max_size
+
+    # returns False if the key has been seen before
+    def add(self, key):
+        with self._lock:
+            if key in self._keys:
+                self._keys.move_to_end(key)
+                return False
+            self._keys[key] = True
+            while len(self._keys) > self.max_size:
+                self._keys.popitem(last=False)
+            return True
+
+    def __len__(self):
+        return len(self._keys)
@@ -0,0 +1,44 @@
+# coding=utf-8
+from __future__ import absolute_import
+
+import collections
+import threading
+import time
+
+# Collects the progress messages of a job together with webcam frames taken at a steady pace, so they
+# can go out as one message per interval with a single contact sheet instead of a message and an upload
+# per update. Frames are spread evenly over the interval, at most max_frames of them are kept.
+class ProgressDigest(object):
+    def __init__(self, interval, max_frames):
+        self._lock = threading.Lock()
+        self._lines = []
+        self._frames = collections.deque(maxlen=max(1, max_frames))
+        self._started = time.time()
+        self.interval = max(60, interval)
+        self.max_frames = max(0, max_frames)
+
+    # how often the timer should fire to take the frames and notice the end of the interval
+    @property
+    def tick_interval(self):
+        if self.max_frames:
+            return self.interval / float(self.max_frames)
+        return self.interval
+
+    def add_line(self, text):
+        with self._lock:
+            self._lines.append((time.time(), text))
+
+    def add_frame(self, data):
+        with self._lock:
+            self._frames.append(data)
+
+    def due(self):
+        return time.time() - self._started >= self.interval - 1
+
+    def take(self):
+        with self._lock:
+            lines, frames = self._lines, list(self._frames)
+            self._lines = []
+            self._frames.clear()
+            self._started = time.time()
+        return lines, frames
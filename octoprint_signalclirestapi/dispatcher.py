@@ -0,0 +1,293 @@
+# coding=utf-8
+from __future__ import absolute_import
+
+import collections
+import concurrent.futures
+import threading
+import time
+
+from .ratelimit import PRIORITY_NORMAL, PRIORITY_HIGH
+
+OVERFLOW_DROP_OLDEST_PROGRESS = "dropoldestprogress"
+OVERFLOW_BLOCK = "block"
+OVERFLOW_REJECT = "reject"
+
+OVERFLOW_POLICIES = (OVERFLOW_DROP_OLDEST_PROGRESS, OVERFLOW_BLOCK, OVERFLOW_REJECT)
+
+KIND_EVENT = "event"
+KIND_PROGRESS = "progress"
+KIND_REPLY = "reply"
+
+# Long-lived pool of worker threads draining a bounded queue of outbound jobs.
+#
+# When the queue is full the overflow policy decides what happens to a new job:
+#   dropoldestprogress - drop the oldest queued progress message, reject the new job if there is none
+#   block              - wait up to block_timeout seconds for a free slot
+#   reject             - drop the new job right away
+#
+# Jobs run by priority, first in first out within one. A worker may sit in the rate limiter for minutes,
+# so a high priority job that finds every worker busy gets a thread of its own instead of waiting.
+class SendDispatcher(object):
+
+    def __init__(self, logger, workers=2, queue_size=20, overflow=OVERFLOW_DROP_OLDEST_PROGRESS, block_timeout=30, metrics=None):
+        self._logger = logger
+        self._metrics = metrics
+        self._lock = threading.Lock()
+        self._not_empty = threading.Condition(self._lock)
+        self._not_full = threading.Condition(self._lock)
+        self._queue = collections.deque()
+        self._threads = []
+        self._running = False
+        self._busy = 0
+
+        self._workers = 1
+        self._queue_size = 1
+        self._overflow = OVERFLOW_DROP_OLDEST_PROGRESS
+        self._block_timeout = block_timeout
+
+        self._submitted = 0
+        self._completed = 0
+        self._failed = 0
+        self._dropped = 0
+        self._rejected = 0
+        self._high_water = 0
+
+        self.configure(workers, queue_size, overflow)
+
+    def configure(self, workers, queue_size, overflow):
+        with self._lock:
+            self._workers = max(1, int(workers))
+            self._queue_size = max(1, int(queue_size))
+            if overflow not in OVERFLOW_POLICIES:
+                self._logger.warning("SendDispatcher: unknown overflow policy [{}] - falling back to [{}]".format(overflow, OVERFLOW_DROP_OLDEST_PROGRESS))
+                overflow = OVERFLOW_DROP_OLDEST_PROGRESS
+            self._overflow = overflow
+
+            if self._running:
+                self._spawn_workers()
+            # surplus workers notice the smaller pool size and exit on their own
+            self._not_empty.notify_all()
+            self._not_full.notify_all()
+
+    def start(self):
+        with self._lock:
+            if self._running:
+                return
+            self._running = True
+            self._spawn_workers()
+
+    def shutdown(self, wait=True, timeout=None):
+        with self._lock:
+            self._running = False
+            threads = list(self._threads)
+            self._not_empty.notify_all()
+            self._not_full.notify_all()
+
+        if wait:
+            for thread in threads:
+                thread.join(timeout)
+
+    def submit(self, job, args=(), kind=KIND_EVENT, priority=PRIORITY_NORMAL):
+        with self._lock:
+            if not self._running:
+                self._logger.warning("SendDispatcher: not running - rejecting [{}] job".format(kind))
+                self._rejected += 1
+                return False
+
+            if priority >= PRIORITY_HIGH and self._busy >= self._workers:
+                self._submitted += 1
+                self._busy += 1
+                thread = threading.Thread(target=self._run_job, args=(kind, job, args, time.time()), name="signalclirestapi-send-urgent")
+                thread.daemon = True
+                thread.start()
+                self._logger.debug("SendDispatcher: all workers busy - running [{}] job on its own thread".format(kind))
+                return True
+
+            if len(self._queue) >= self._queue_size and not self._make_room(kind):
+                return False
+
+            self._queue.append((kind, job, args, time.time(), priority))
+            self._submitted += 1
+
+            depth = len(self._queue)
+            self._high_water = max(self._high_water, depth)
+            if depth * 4 >= self._queue_size * 3:
+                self._logger.warning("SendDispatcher: queue depth [{}/{}] - REST API is falling behind".format(depth, self._queue_size))
+
+            self._not_empty.notify()
+            return True
+
+    @property
+    def queue_depth(self):
+        with self._lock:
+            return len(self._queue)
+
+    def stats(self):
+        with self._lock:
+            return dict(
+                workers=self._workers,
+                alive=len(self._threads),
+                busy=self._busy,
+                queue_depth=len(self._queue),
+                queue_size=self._queue_size,
+                high_water=self._high_water,
+                overflow=self._overflow,
+                submitted=self._submitted,
+                completed=self._completed,
+                failed=self._failed,
+                dropped=self._dropped,
+                rejected=self._rejected
+            )
+
+    # must be called with the lock held
+    def _make_room(self, kind):
+        if self._overflow == OVERFLOW_DROP_OLDEST_PROGRESS:
+            for item in self._queue:
+                if item[0] == KIND_PROGRESS:
+                    self._queue.remove(item)
+                    self._dropped += 1
+                    self._logger.warning("SendDispatcher: queue full - dropped oldest progress message")
+                    return True
+        elif self._overflow == OVERFLOW_BLOCK:
+            deadline = time.time() + self._block_timeout
+            while self._running and len(self._queue) >= self._queue_size:
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    break
+                self._not_full.wait(remaining)
+            if self._running and len(self._queue) < self._queue_size:
+                return True
+
+        self._rejected += 1
+        self._logger.warning("SendDispatcher: queue full - rejecting [{}] job".format(kind))
+        return False
+
+    # must be called with the lock held
+    def _spawn_workers(self):
+        self._threads = [t for t in self._threads if t.is_alive()]
+        while len(self._threads) < self._workers:
+            thread = threading.Thread(target=self._run, name="signalclirestapi-send-{}".format(len(self._threads)))
+            thread.daemon = True
+            self._threads.append(thread)
+            thread.start()
+
+    def _run(self):
+        me = threading.current_thread()
+        while True:
+            with self._lock:
+                while self._running and not self._queue and len(self._threads) <= self._workers:
+                    self._not_empty.wait()
+
+                # keep draining on shutdown so that e.g. the "Shutting down" notification still goes out
+                if (not self._running and not self._queue) or len(self._threads) > self._workers:
+                    if me in self._threads:
+                        self._threads.remove(me)
+                    return
+
+                item = max(self._queue, key=lambda item: item[4])
+                self._queue.remove(item)
+                kind, job, args, queued, _ = item
+                self._busy += 1
+                self._not_full.notify()
+
+            self._run_job(kind, job, args, queued)
+
+    # the caller counted the job as busy
+    def _run_job(self, kind, job, args, queued):
+        try:
+            self._logger.debug("SendDispatcher: running [{}] job after [{:.3f}s] in queue".format(kind, time.time() - queued))
+            if self._metrics: self._metrics.observe("queue_wait", time.time() - queued)
+            job(*args)
+            failed = False
+        except BaseException as e:
+            self._logger.exception("SendDispatcher: job failed: [{}]".format(e))
+            failed = True
+
+        with self._lock:
+            self._busy -= 1
+            if failed:
+                self._failed += 1
+            else:
+                self._completed += 1
+
+# Runs the same call for a list of items (typically recipients) on a shared, capped thread pool.
+# Failures are collected per item instead of the first one aborting the rest. A separate instance runs
+# the stages of a message that overlap each other, a stage may fan out itself so they can't share a pool.
+#
+# A pool replaced after a settings change is retired: calls already running or queued on it finish, and
+# its threads go away once the last of them is done. Anyone still holding it afterwards runs inline.
+class FanOut(object):
+    def __init__(self, logger, max_workers=4, metrics=None):
+        self._logger = logger
+        self._metrics = metrics
+        self.max_workers = max(1, int(max_workers))
+        self._executor = concurrent.futures.ThreadPoolExecutor(max_workers=self.max_workers)
+        self._lock = threading.Lock()
+        self._active = 0
+        self._retired = False
+
+    def shutdown(self, wait=False):
+        self._executor.shutdown(wait=wait)
+
+    def retire(self):
+        with self._lock:
+            self._retired = True
+            idle = self._active == 0
+        if idle:
+            self._executor.shutdown(wait=False)
+
+    def run(self, label, fn, items):
+        items = list(items)
+        if len(items) == 1 or not self._enter():
+            results = [self._timed(label, fn, item) for item in items]
+        else:
+            try:
+                results = [f.result() for f in [self._executor.submit(self._timed, label, fn, item) for item in items]]
+            finally:
+                self._leave()
+
+        failures = dict((item, error) for item, error in zip(items, results) if error is not None)
+        for item, error in failures.items():
+            self._logger.warning("FanOut: [{}] failed for [{}]: [{}]".format(label, item, error))
+        return failures
+
+    # runs a single call in the background, the future carries its result or exception
+    def submit(self, fn, *args):
+        if not self._enter():
+            future = concurrent.futures.Future()
+            try:
+                future.set_result(fn(*args))
+            except BaseException as e:
+                future.set_exception(e)
+            return future
+
+        future = self._executor.submit(fn, *args)
+        future.add_done_callback(lambda _: self._leave())
+        return future
+
+    # False once a retired pool has drained and shut down
+    def _enter(self):
+        with self._lock:
+            if self._retired and self._active == 0:
+                return False
+            self._active += 1
+            return True
+
+    def _leave(self):
+        with self._lock:
+            self._active -= 1
+            drained = self._retired and self._active == 0
+        if drained:
+            self._executor.shutdown(wait=False)
+
+    def _timed(self, label, fn, item):
+        start = time.time()
+        try:
+            fn(item)
+            return None
+        except Exception as e:
+            return e
+        finally:
+            elapsed = time.time() - start
+            if self._metrics: self._metrics.observe("fanout_" + label.replace("-", "_"), elapsed)
+            self._logger.debug("FanOut: [{}] for [{}] took [{:.3f}s]".format(label, item, elapsed))
@@ -0,0 +1,94 @@
+# coding=utf-8
+from __future__ import absolute_import
+
+import base64
+import binascii
+import json
+import os
+import threading
+import time
+
+GROUP_PREFIX = "group."
+
+# signal-cli-rest-api builds the group id as "group." + base64(internal_id), so the internal id can usually
+# be recovered without asking the server
+def internal_id_from_group_id(group_id):
+    if not group_id or not group_id.startswith(GROUP_PREFIX):
+        return None
+    try:
+        return base64.b64decode(group_id[len(GROUP_PREFIX):].encode("ascii"), validate=True).decode("ascii")
+    except (binascii.Error, ValueError):
+        return None
+
+# Persisted group id -> internal id index for one sender account.
+#
+# Entries are added as groups are created, so resolving the group of an inbound message or of a newly
+# created job group is a dict lookup. Only a miss that cannot be resolved locally lists the groups on the
+# account, and at most once every refresh_interval seconds.
+class GroupIndex(object):
+    def __init__(self, logger, path, sender, list_groups, refresh_interval=60):
+        self._logger = logger
+        self._path = path
+        self._sender = sender
+        self._list_groups = list_groups
+        self._lock = threading.Lock()
+        self._groups = {}
+        self._refreshed = 0
+        self.refresh_interval = refresh_interval
+        self._load()
+
+    def _load(self):
+        try:
+            with open(self._path) as f:
+                data = json.load(f)
+            if data.get("sender") == self._sender:
+                self._groups = dict(data.get("groups", {}))
+        except (IOError, OSError, ValueError):
+            pass
+
+    # must be called with the lock held
+    def _save(self):
+        tmp = self._path + ".tmp"
+        try:
+            with open(tmp, "w") as f:
+                json.dump(dict(sender=self._sender, groups=self._groups), f)
+            os.replace(tmp, self._path)
+        except (IOError, OSError) as e:
+            self._logger.warning("GroupIndex: could not save [{}]: [{}]".format(self._path, e))
+
+    def add(self, group_id, internal_id):
+        with self._lock:
+            if self._groups.get(group_id) != internal_id:
+                self._groups[group_id] = internal_id
+                self._save()
+
+    def internal_id(self, group_id):
+        with self._lock:
+            internal_id = self._groups.get(group_id)
+        if internal_id is not None:
+            return internal_id
+
+        internal_id = internal_id_from_group_id(group_id)
+        if internal_id is not None:
+            self.add(group_id, internal_id)
+            return internal_id
+
+        self.refresh()
+        with self._lock:
+            return self._groups.get(group_id)
+
+    def refresh(self, force=False):
+        with self._lock:
+            if not force and time.time() - self._refreshed < self.refresh_interval:
+                return
+            self._refreshed = time.time()
+
+        start = time.time()
+        groups = self._list_groups()
+        with self._lock:
+            self._groups = dict((group["id"], group["internal_id"]) for group in groups if "id" in group and "internal_id" in group)
+            self._save()
+        self._logger.debug("GroupIndex: refreshed [{}] groups in [{:.3f}s]".format(len(groups), time.time() - start))
+
+    def __len__(self):
+        return len(self._groups)
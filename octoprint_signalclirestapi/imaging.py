@@ -0,0 +1,178 @@
+# coding=utf-8
+from __future__ import absolute_import
+
+import collections
+import io
+import math
+import threading
+
+# Pillow is installed with the plugin, should its import still fail (e.g. no wheel for the platform and
+# no compiler) snapshots are sent exactly as the webcam delivers them
+try:
+    from PIL import Image
+except ImportError:
+    Image = None
+
+# lowest JPEG quality the byte budget may push a snapshot down to before it is scaled down instead
+MIN_QUALITY = 30
+DOWNSCALE_STEP = 0.75
+MAX_DOWNSCALES = 5
+
+# longest side of a single frame on a contact sheet, and the gap between frames
+SHEET_TILE_SIZE = 480
+SHEET_GAP = 4
+
+SnapshotOptions = collections.namedtuple("SnapshotOptions", ["flip_h", "flip_v", "rotate90", "max_dimension", "max_bytes", "quality"])
+
+def _transpose(name):
+    return getattr(getattr(Image, "Transpose", Image), name)
+
+def _resample(name):
+    return getattr(getattr(Image, "Resampling", Image), name)
+
+# Post-processes webcam snapshots: orientation as set up in OctoPrint's webcam settings, a maximum
+# dimension and a byte budget met by searching for the highest JPEG quality that fits.
+#
+# JPEGs that need shrinking are decoded by libjpeg at 1/2, 1/4 or 1/8 scale right away, which is much
+# faster than decoding the full frame. A snapshot that already fits is passed through without being
+# decoded at all. The provider hands the same bytes to every message asking within its ttl, so the
+# last result is kept and reused for them.
+class SnapshotProcessor(object):
+    def __init__(self, logger):
+        self._logger = logger
+        self._lock = threading.Lock()
+        self._last = None
+
+    @property
+    def available(self):
+        return Image is not None
+
+    def process(self, data, options):
+        if Image is None or not data:
+            return data
+
+        with self._lock:
+            last = self._last
+        if last is not None and last[0] is data and last[1] == options:
+            return last[2]
+
+        try:
+            result = self._process(data, options)
+        except Exception as e:
+            self._logger.warning("SnapshotProcessor: could not process snapshot, sending it as is: [{}]".format(e))
+            result = data
+
+        with self._lock:
+            self._last = (data, options, result)
+        return result
+
+    def _process(self, data, options):
+        image = Image.open(io.BytesIO(data))
+        width, height = image.size
+        limit = options.max_dimension
+        resize = limit > 0 and max(width, height) > limit
+        orient = options.flip_h or options.flip_v or options.rotate90
+        over_budget = options.max_bytes > 0 and len(data) > options.max_bytes
+
+        if not resize and not orient and not over_budget:
+            return data
+
+        if resize:
+            scale = float(limit) / max(width, height)
+            if image.format == "JPEG":
+                image.draft("RGB", (int(width * scale), int(height * scale)))
+        image = image.convert("RGB")
+        if resize:
+            image.thumbnail((limit, limit), _resample("BILINEAR"))
+
+        image = _orient(image, options)
+
+        result, image = self._fit(image, options)
+        self._logger.debug("SnapshotProcessor: [{}x{}] [{}] bytes -> [{}x{}] [{}] bytes".format(width, height, len(data), image.size[0], image.size[1], len(result)))
+
+        # recompressing alone must never make things worse
+        if not resize and not orient and len(result) >= len(data):
+            return data
+        return result
+
+    # tiles the frames into one JPEG, oldest first and left to right; None if there is nothing to tile
+    def contact_sheet(self, frames, options, tile_size=SHEET_TILE_SIZE):
+        if Image is None:
+            return None
+
+        tiles = []
+        for data in frames:
+            try:
+                image = Image.open(io.BytesIO(data))
+                if image.format == "JPEG":
+                    image.draft("RGB", (tile_size, tile_size))
+                image = image.convert("RGB")
+                image.thumbnail((tile_size, tile_size), _resample("BILINEAR"))
+                tiles.append(_orient(image, options))
+            except Exception as e:
+                self._logger.warning("SnapshotProcessor: skipping frame of contact sheet: [{}]".format(e))
+        if not tiles:
+            return None
+
+        columns = int(math.ceil(math.sqrt(len(tiles))))
+        rows = int(math.ceil(len(tiles) / float(columns)))
+        tile_width = max(tile.size[0] for tile in tiles)
+        tile_height = max(tile.size[1] for tile in tiles)
+
+        sheet = Image.new("RGB", (columns * tile_width + (columns + 1) * SHEET_GAP, rows * tile_height + (rows + 1) * SHEET_GAP))
+        for i, tile in enumerate(tiles):
+            column, row = i % columns, i // columns
+            x = SHEET_GAP + column * (tile_width + SHEET_GAP) + (tile_width - tile.size[0]) // 2
+            y = SHEET_GAP + row * (tile_height + SHEET_GAP) + (tile_height - tile.size[1]) // 2
+            sheet.paste(tile, (x, y))
+
+        result, sheet = self._fit(sheet, options)
+        self._logger.debug("SnapshotProcessor: contact sheet of [{}] frames [{}x{}] [{}] bytes".format(len(tiles), sheet.size[0], sheet.size[1], len(result)))
+        return result
+
+    def _fit(self, image, options):
+        result = _encode(image, options.quality)
+        if options.max_bytes <= 0 or len(result) <= options.max_bytes:
+            return result, image
+
+        # never go above the configured quality, even if that is below the usual floor
+        min_quality = min(MIN_QUALITY, options.quality)
+        for _ in range(MAX_DOWNSCALES):
+            # if even the lowest quality is too big the image has to get smaller, bytes grow about with the pixel count
+            floor = _encode(image, min_quality)
+            if len(floor) > options.max_bytes:
+                result = floor
+                scale = min(DOWNSCALE_STEP, 0.95 * (float(options.max_bytes) / len(floor)) ** 0.5)
+                width, height = image.size
+                image = image.resize((max(1, int(width * scale)), max(1, int(height * scale))), _resample("BILINEAR"))
+                continue
+
+            # binary search for the highest quality within the budget
+            best = floor
+            low, high = min_quality + 1, options.quality - 1
+            while low <= high:
+                quality = (low + high) // 2
+                encoded = _encode(image, quality)
+                if len(encoded) <= options.max_bytes:
+                    best = encoded
+                    low = quality + 1
+                else:
+                    high = quality - 1
+            return best, image
+
+        return result, image
+
+# same order as the ffmpeg filters of the gif: vflip, hflip, then 90 degrees clockwise
+def _orient(image, options):
+    if options.flip_v:
+        image = image.transpose(_transpose("FLIP_TOP_BOTTOM"))
+    if options.flip_h:
+        image = image.transpose(_transpose("FLIP_LEFT_RIGHT"))
+    if options.rotate90:
+        image = image.transpose(_transpose("ROTATE_270"))
+    return image
+
+def _encode(image, quality):
+    output = io.BytesIO()
+    image.save(output, "JPEG", quality=int(quality))
+    return output.getvalue()
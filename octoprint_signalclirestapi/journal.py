@@ -0,0 +1,217 @@
+# coding=utf-8
+from __future__ import absolute_import
+
+import json
+import os
+import random
+import sqlite3
+import threading
+import time
+
+from .attachment import Attachment
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS outbound (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    created REAL NOT NULL,
+    message TEXT NOT NULL,
+    snapshot INTEGER NOT NULL,
+    snapshot_as_gif INTEGER NOT NULL,
+    kind TEXT NOT NULL,
+    priority INTEGER NOT NULL,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    next_attempt REAL NOT NULL,
+    last_error TEXT,
+    attachments TEXT,
+    recipients TEXT
+)
+"""
+
+class JournalEntry(object):
+    def __init__(self, row):
+        self.id, self.created, self.message, snapshot, snapshot_as_gif, self.kind, self.priority, self.attempts, attachments, recipients = row
+        self.snapshot = bool(snapshot)
+        self.snapshot_as_gif = bool(snapshot_as_gif)
+        self.attachment_files = json.loads(attachments) if attachments else []
+        # only set when some recipients already got the message, None means everyone
+        self.recipients = json.loads(recipients) if recipients else None
+
+    # the media captured for the first attempt, so a replayed "job done" shows the finished job
+    def attachments(self):
+        return [Attachment(filename=filename) for filename in self.attachment_files if os.path.exists(filename)]
+
+# Append-only SQLite journal of outbound messages that survives restarts of OctoPrint and outages of the
+# REST container.
+#
+# Every message is recorded before it is handed to the send workers and removed once it was delivered.
+# Failed sends stay in the journal with an exponential backoff, together with a copy of their captured
+# attachments. Entries older than max_age hours, beyond max_entries or beyond max_mb of attachments are
+# dropped oldest first, so an outage cannot fill the SD card.
+#
+# Messages handed to the send workers are kept in flight until they are completed or failed, however long
+# they wait in the queue or take to send, so a replay never hands out the same message twice.
+class OutboundJournal(object):
+    def __init__(self, logger, folder, max_entries=200, max_age=48, max_mb=50, backoff_min=30, backoff_max=1800):
+        self._logger = logger
+        self._lock = threading.Lock()
+        self._folder = folder
+        self._media_folder = os.path.join(folder, "journal")
+        if not os.path.exists(self._media_folder):
+            os.makedirs(self._media_folder)
+
+        self._db = sqlite3.connect(os.path.join(folder, "journal.db"), check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute(SCHEMA)
+        # anything left over was in flight or waiting when we went down
+        self._db.execute("UPDATE outbound SET next_attempt = 0")
+        self._db.commit()
+        self._in_flight = set()
+        self._closing = False
+
+        self.configure(max_entries, max_age, max_mb, backoff_min, backoff_max)
+
+    def configure(self, max_entries, max_age, max_mb, backoff_min, backoff_max):
+        with self._lock:
+            self.max_entries = max_entries
+            self.max_age = max_age
+            self.max_mb = max_mb
+            self.backoff_min = backoff_min
+            self.backoff_max = backoff_max
+
+    # messages still in flight finish first, the connection is closed once the last of them is done
+    def close(self):
+        with self._lock:
+            self._closing = True
+            self._close_if_drained()
+
+    def record(self, message, snapshot, snapshot_as_gif, kind, priority):
+        now = time.time()
+        with self._lock:
+            if self._closing:
+                return None
+            cursor = self._db.execute(
+                "INSERT INTO outbound (created, message, snapshot, snapshot_as_gif, kind, priority, next_attempt) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (now, message, int(bool(snapshot)), int(bool(snapshot_as_gif)), kind, priority, now))
+            self._db.commit()
+            self._in_flight.add(cursor.lastrowid)
+            return cursor.lastrowid
+
+    def complete(self, entry_id):
+        with self._lock:
+            if self._db is None:
+                return
+            row = self._db.execute("SELECT attachments FROM outbound WHERE id = ?", (entry_id,)).fetchone()
+            self._db.execute("DELETE FROM outbound WHERE id = ?", (entry_id,))
+            self._db.commit()
+            self._in_flight.discard(entry_id)
+            self._close_if_drained()
+        if row:
+            self._remove_files(json.loads(row[0]) if row[0] else [])
+
+    # recipients narrows the next attempts down to the ones that did not get the message
+    def failed(self, entry_id, error, attachments=None, recipients=None):
+        with self._lock:
+            if self._db is None:
+                return
+            row = self._db.execute("SELECT attempts, attachments, recipients FROM outbound WHERE id = ?", (entry_id,)).fetchone()
+            if row is None:
+                self._in_flight.discard(entry_id)
+                self._close_if_drained()
+                return
+            attempts = row[0] + 1
+            files = json.loads(row[1]) if row[1] else []
+            if recipients is None:
+                recipients = json.loads(row[2]) if row[2] else None
+            if not files and attachments:
+                files = self._save_attachments(entry_id, attachments)
+
+            delay = min(self.backoff_max, self.backoff_min * 2 ** (attempts - 1))
+            delay = random.uniform(delay / 2, delay)
+            self._db.execute("UPDATE outbound SET attempts = ?, next_attempt = ?, last_error = ?, attachments = ?, recipients = ? WHERE id = ?",
+                             (attempts, time.time() + delay, str(error), json.dumps(files), json.dumps(recipients) if recipients else None, entry_id))
+            self._db.commit()
+            self._in_flight.discard(entry_id)
+            self._close_if_drained()
+        self._logger.info("OutboundJournal: message [{}] failed [{}] times, retrying in [{:.0f}s]".format(entry_id, attempts, delay))
+
+    # hands out due entries that are not in flight yet, they stay in flight until completed or failed
+    def take_due(self, limit=10):
+        with self._lock:
+            if self._closing:
+                return []
+            rows = self._db.execute(
+                "SELECT id, created, message, snapshot, snapshot_as_gif, kind, priority, attempts, attachments, recipients FROM outbound "
+                "WHERE next_attempt <= ? ORDER BY priority DESC, id", (time.time(),)).fetchall()
+            rows = [row for row in rows if row[0] not in self._in_flight][:limit]
+            self._in_flight.update(row[0] for row in rows)
+        return [JournalEntry(row) for row in rows]
+
+    # a message in flight is never dropped, its send worker is still reading the row and its attachments
+    def compact(self):
+        expired = []
+        with self._lock:
+            if self._closing:
+                return
+            rows = self._db.execute("SELECT id, created, attachments FROM outbound ORDER BY id DESC").fetchall()
+            cutoff = time.time() - self.max_age * 3600
+            budget = self.max_mb * 1024 * 1024
+            for i, (entry_id, created, attachments) in enumerate(rows):
+                files = json.loads(attachments) if attachments else []
+                budget -= sum(os.path.getsize(f) for f in files if os.path.exists(f))
+                if entry_id in self._in_flight:
+                    continue
+                if i >= self.max_entries or created < cutoff or budget < 0:
+                    expired.append((entry_id, files))
+
+            if expired:
+                self._db.executemany("DELETE FROM outbound WHERE id = ?", [(entry_id,) for entry_id, _ in expired])
+                self._db.commit()
+            if not rows or expired:
+                self._db.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+
+            # media left behind by a crash between saving and recording it, listed while no failed() can be saving any
+            known = set(f for _, _, attachments in rows if attachments for f in json.loads(attachments))
+            in_flight = set("{}-".format(entry_id) for entry_id in self._in_flight)
+            orphans = [os.path.join(self._media_folder, name) for name in os.listdir(self._media_folder)
+                       if os.path.join(self._media_folder, name) not in known and not any(name.startswith(prefix) for prefix in in_flight)]
+
+        for _, files in expired:
+            self._remove_files(files)
+        self._remove_files(orphans)
+
+        if expired:
+            self._logger.warning("OutboundJournal: dropped [{}] undeliverable messages".format(len(expired)))
+
+    def stats(self):
+        with self._lock:
+            if self._db is None:
+                return dict(pending=0, oldest=None)
+            pending, oldest = self._db.execute("SELECT COUNT(*), MIN(created) FROM outbound").fetchone()
+        return dict(pending=pending, oldest=oldest)
+
+    # must be called with the lock held
+    def _close_if_drained(self):
+        if self._closing and not self._in_flight and self._db is not None:
+            self._db.close()
+            self._db = None
+
+    # must be called with the lock held
+    def _save_attachments(self, entry_id, attachments):
+        files = []
+        for i, attachment in enumerate(attachments):
+            path = os.path.join(self._media_folder, "{}-{}{}".format(entry_id, i, attachment.suffix))
+            try:
+                with open(path, "wb") as f:
+                    for chunk in attachment.chunks():
+                        f.write(chunk)
+                files.append(path)
+            except Exception as e:
+                self._logger.warning("OutboundJournal: could not keep attachment of [{}]: [{}]".format(entry_id, e))
+        return files
+
+    def _remove_files(self, files):
+        for path in files:
+            try:
+                os.remove(path)
+            except OSError:
+                pass
@@ -0,0 +1,52 @@
+# coding=utf-8
+from __future__ import absolute_import
+
+import re
+import string
+
+class TemplateError(ValueError):
+    pass
+
+CONVERSIONS = (None, "r", "s", "a")
+
+# A message template parsed once when the settings are loaded or saved.
+#
+# It records the tags it references so that only the providers for those tags (e.g. a printer state
+# or temperature query) need to run when it is rendered. Unknown tags are rejected here instead of
+# raising a KeyError in a send worker later on. Format specs are parsed as well: a tag nested in one
+# (e.g. {host:>{progress}}) would put e.g. "42%" into the spec, so those are rejected like unknown conversions.
+class MessageTemplate(object):
+    def __init__(self, source, known_tags, providers=None):
+        self.source = source
+
+        tags = set()
+        try:
+            _parse(source, known_tags, tags)
+        except ValueError as e:
+            if isinstance(e, TemplateError):
+                raise
+            raise TemplateError("Invalid template: {}".format(e))
+
+        self.tags = frozenset(tags)
+        providers = providers or {}
+        self.providers = tuple(sorted(set(providers[tag] for tag in self.tags if tag in providers)))
+
+    def render(self, tags):
+        return self.source.format(**tags)
+
+def _parse(source, known_tags, tags, spec_of=None):
+    for _, field_name, format_spec, conversion in string.Formatter().parse(source):
+        if field_name is None:
+            continue
+        if spec_of is not None:
+            raise TemplateError("Tags inside the format spec of {{{}}} are not supported".format(spec_of))
+        tag = re.split(r"[.\[]", field_name, 1)[0]
+        if not tag or tag.isdigit():
+            raise TemplateError("Positional placeholders are not supported, please use one of the supported tags")
+        if tag not in known_tags:
+            raise TemplateError("Unknown tag {{{}}}".format(tag))
+        if conversion not in CONVERSIONS:
+            raise TemplateError("Unknown conversion !{} of {{{}}}".format(conversion, tag))
+        tags.add(tag)
+        if format_spec:
+            _parse(format_spec, known_tags, tags, tag)
@@ -0,0 +1,124 @@
+# coding=utf-8
+from __future__ import absolute_import
+
+import bisect
+import contextlib
+import threading
+import time
+
+# upper bounds in seconds, from a cached snapshot to a long clip encode
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+PREFIX = "octoprint_signalclirestapi_"
+
+class Histogram(object):
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+        self.max = max(self.max, value)
+
+    # estimated from the bucket bounds, good enough to spot where the time goes
+    def quantile(self, q):
+        if not self.count:
+            return None
+        rank = q * self.count
+        seen = 0
+        for i, count in enumerate(self.counts):
+            seen += count
+            if seen >= rank:
+                return min(self.buckets[i], self.max) if i < len(self.buckets) else self.max
+        return self.max
+
+# Counters and per-stage timing histograms of the send and receive paths.
+#
+# Updates are a dict lookup and a couple of additions under one lock, cheap enough for every message.
+# Gauges are not stored but sampled from callbacks whenever the metrics are read.
+class Metrics(object):
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counters = {}
+        self._histograms = {}
+        self._gauges = {}
+        self.started = time.time()
+
+    def inc(self, name, value=1):
+        with self._lock:
+            self._counters[name] = self._counters.get(name, 0) + value
+
+    def observe(self, stage, seconds):
+        with self._lock:
+            histogram = self._histograms.get(stage)
+            if histogram is None:
+                histogram = self._histograms[stage] = Histogram()
+            histogram.observe(seconds)
+
+    @contextlib.contextmanager
+    def time(self, stage):
+        start = time.time()
+        try:
+            yield
+        except BaseException:
+            self.inc(stage + "_errors")
+            raise
+        finally:
+            self.observe(stage, time.time() - start)
+
+    def gauge(self, name, callback):
+        self._gauges[name] = callback
+
+    def _sample_gauges(self):
+        values = {}
+        for name, callback in list(self._gauges.items()):
+            try:
+                value = callback()
+            except Exception:
+                value = None
+            if value is not None:
+                values[name] = value
+        return values
+
+    def as_dict(self):
+        gauges = self._sample_gauges()
+        with self._lock:
+            stages = dict((stage, dict(
+                count=h.count,
+                sum=round(h.sum, 6),
+                max=round(h.max, 6),
+                p50=h.quantile(0.5),
+                p99=h.quantile(0.99)
+            )) for stage, h in self._histograms.items())
+            return dict(uptime=time.time() - self.started, counters=dict(self._counters), stages=stages, gauges=gauges)
+
+    # Prometheus text exposition format 0.0.4
+    def as_prometheus(self):
+        gauges = self._sample_gauges()
+        lines = []
+        with self._lock:
+            for name in sorted(self._counters):
+                lines.append("# TYPE {}{}_total counter".format(PREFIX, name))
+                lines.append("{}{}_total {}".format(PREFIX, name, self._counters[name]))
+
+            if self._histograms:
+                lines.append("# TYPE {}stage_seconds histogram".format(PREFIX))
+            for stage in sorted(self._histograms):
+                h = self._histograms[stage]
+                cumulative = 0
+                for bound, count in zip(h.buckets, h.counts):
+                    cumulative += count
+                    lines.append('{}stage_seconds_bucket{{stage="{}",le="{}"}} {}'.format(PREFIX, stage, bound, cumulative))
+                lines.append('{}stage_seconds_bucket{{stage="{}",le="+Inf"}} {}'.format(PREFIX, stage, h.count))
+                lines.append('{}stage_seconds_sum{{stage="{}"}} {}'.format(PREFIX, stage, h.sum))
+                lines.append('{}stage_seconds_count{{stage="{}"}} {}'.format(PREFIX, stage, h.count))
+
+        for name in sorted(gauges):
+            lines.append("# TYPE {}{} gauge".format(PREFIX, name))
+            lines.append("{}{} {}".format(PREFIX, name, float(gauges[name])))
+        return "\n".join(lines) + "\n"
@@ -0,0 +1,74 @@
+# coding=utf-8
+from __future__ import absolute_import
+
+import collections
+import time
+
+from octoprint.printer import PrinterCallback
+
+HEATERS = (("tool0", "tool"), ("bed", "bed"), ("chamber", "chamber"))
+
+PrinterState = collections.namedtuple("PrinterState", ["state", "printing", "temperatures", "filename", "completion", "print_time", "updated"])
+
+EMPTY_STATE = PrinterState(None, False, {}, None, None, None, None)
+
+# Compact copy of the printer state that OctoPrint pushes to us.
+#
+# OctoPrint calls the callbacks from its own threads about twice a second; we only pick out the handful of
+# values our tags need and swap in a new immutable snapshot, so rendering a message reads it without
+# touching the printer or taking a lock.
+class PrinterStateCache(PrinterCallback):
+    def __init__(self):
+        self.snapshot = EMPTY_STATE
+
+    def on_printer_send_initial_data(self, data):
+        self.on_printer_send_current_data(data)
+
+    def on_printer_send_current_data(self, data):
+        state = data.get("state") or {}
+        flags = state.get("flags") or {}
+        job = data.get("job") or {}
+        progress = data.get("progress") or {}
+        snapshot = self.snapshot
+
+        temperatures = snapshot.temperatures
+        if data.get("temps"):
+            temperatures = _temperatures(data["temps"][-1])
+
+        self.snapshot = snapshot._replace(
+            state=state.get("text", snapshot.state),
+            printing=bool(flags.get("printing") or flags.get("paused") or flags.get("pausing")),
+            temperatures=temperatures,
+            filename=(job.get("file") or {}).get("name"),
+            completion=progress.get("completion"),
+            print_time=progress.get("printTime"),
+            updated=time.time()
+        )
+
+    def on_printer_add_temperature(self, data):
+        self.snapshot = self.snapshot._replace(temperatures=_temperatures(data), updated=time.time())
+
+    # seeds the cache before the first push arrives
+    def refresh(self, printer):
+        self.on_printer_send_current_data(printer.get_current_data() or {})
+        self.on_printer_add_temperature(printer.get_current_temperatures() or {})
+
+    def state_tags(self, tags):
+        tags["state"] = self.snapshot.state or "unknown"
+
+    def temperature_tags(self, tags):
+        temperatures = self.snapshot.temperatures
+        for heater, tag in HEATERS:
+            if heater in temperatures:
+                tags[tag + "_temp_actual"], tags[tag + "_temp_target"] = temperatures[heater]
+            elif not temperatures:
+                tags[tag + "_temp_actual"] = "*"
+                tags[tag + "_temp_target"] = "*"
+
+def _temperatures(data):
+    temperatures = {}
+    for heater, _ in HEATERS:
+        values = data.get(heater)
+        if isinstance(values, dict):
+            temperatures[heater] = (values.get("actual"), values.get("target"))
+    return temperatures
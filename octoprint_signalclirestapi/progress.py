@@ -0,0 +1,71 @@
+# coding=utf-8
+from __future__ import absolute_import
+
+import threading
+import time
+
+# DisplayLayerProgress fires this with the current layer in its payload
+LAYER_CHANGED_EVENT = "DisplayLayerProgress_layerChanged"
+
+# Decides when a job's progress is worth a message.
+#
+# Percent thresholds are walked with a pointer, so a callback is a single comparison and a threshold fires
+# once it is crossed, even if OctoPrint jumps past it (e.g. on resume). Several thresholds crossed at once
+# give one message. On top of that a message can go out every N minutes and every N layers; any message
+# restarts the time cadence.
+class ProgressScheduler(object):
+    def __init__(self, thresholds, every_minutes=0, every_layers=0, progress=None):
+        self._lock = threading.Lock()
+        self._thresholds = thresholds
+        self._pointer = 0
+        self._every_seconds = max(0, every_minutes or 0) * 60
+        self._every_layers = max(0, every_layers or 0)
+        self._last_sent = time.time()
+        self._last_layer = 0
+        self._paused = False
+
+        # joining a job that is already running, only thresholds still ahead count
+        if progress is not None:
+            while self._pointer < len(thresholds) and progress > thresholds[self._pointer]:
+                self._pointer += 1
+
+    def on_progress(self, progress):
+        with self._lock:
+            crossed = False
+            while self._pointer < len(self._thresholds) and progress >= self._thresholds[self._pointer]:
+                self._pointer += 1
+                crossed = True
+            return self._fire(crossed)
+
+    def on_layer(self, layer):
+        with self._lock:
+            if not self._every_layers or layer - self._last_layer < self._every_layers:
+                return False
+            self._last_layer = layer
+            return self._fire(True)
+
+    def on_tick(self):
+        with self._lock:
+            return self._fire(False)
+
+    def pause(self):
+        with self._lock:
+            self._paused = True
+
+    def resume(self):
+        with self._lock:
+            self._paused = False
+            self._last_sent = time.time()
+
+    @property
+    def timed(self):
+        return self._every_seconds > 0
+
+    # must be called with the lock held
+    def _fire(self, due):
+        now = time.time()
+        if not due and self._every_seconds and not self._paused:
+            due = now - self._last_sent >= self._every_seconds
+        if due:
+            self._last_sent = now
+        return due
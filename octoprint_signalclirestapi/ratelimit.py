@@ -0,0 +1,156 @@
+# coding=utf-8
+from __future__ import absolute_import
+
+import threading
+import time
+
+PRIORITY_LOW = 0
+PRIORITY_NORMAL = 1
+PRIORITY_HIGH = 2
+
+PRIORITY_NAMES = {PRIORITY_LOW: "low", PRIORITY_NORMAL: "normal", PRIORITY_HIGH: "high"}
+
+# signal-cli reports server side throttling as e.g. "[413] Rate limit exceeded" or a RateLimitException
+def is_rate_limit_error(e):
+    text = str(e).lower()
+    return "rate limit" in text or "ratelimit" in text or "[413]" in text or "[429]" in text
+
+class TokenBucket(object):
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = float(burst)
+        self.updated = time.time()
+        self.blocked_until = 0
+        self.penalty = 0
+
+    def refill(self, now):
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    # seconds until a token above reserve is available
+    def wait_time(self, now, reserve):
+        if now < self.blocked_until:
+            return self.blocked_until - now
+        missing = 1 + reserve - self.tokens
+        if missing <= 0:
+            return 0
+        return missing / self.rate if self.rate > 0 else float("inf")
+
+# Token buckets per sender account and per recipient/group in front of every send.
+#
+# rate is in messages per minute. Low priority messages (progress ticks, STATUS replies) must leave
+# reserve tokens in every bucket and give up after low_wait seconds, so a flood of them cannot starve a
+# failure or cancel notification. When signal reports a rate limit the affected buckets are emptied and
+# blocked for a cooldown that doubles on every consecutive hit and resets after the next success.
+class RateLimiter(object):
+    def __init__(self, logger, sender_rate=30, sender_burst=10, recipient_rate=10, recipient_burst=5, reserve=2, low_wait=10, max_wait=300, cooldown=60, max_cooldown=900):
+        self._logger = logger
+        self._lock = threading.Lock()
+        self._changed = threading.Condition(self._lock)
+        self._buckets = {}
+
+        self.sender_rate = sender_rate
+        self.sender_burst = sender_burst
+        self.recipient_rate = recipient_rate
+        self.recipient_burst = recipient_burst
+        self.reserve = reserve
+        self.low_wait = low_wait
+        self.max_wait = max_wait
+        self.cooldown = cooldown
+        self.max_cooldown = max_cooldown
+
+        self._granted = 0
+        self._dropped = 0
+        self._limited = 0
+
+    # shards maps each sender account to the recipients it sends to
+    def keys(self, shards):
+        keys = []
+        for sender, recipients in shards.items():
+            keys.append(("sender", sender))
+            keys.extend(("recipient", recipient) for recipient in recipients)
+        return keys
+
+    # must be called with the lock held
+    def _bucket(self, key):
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            if key[0] == "sender":
+                bucket = TokenBucket(self.sender_rate / 60.0, self.sender_burst)
+            else:
+                bucket = TokenBucket(self.recipient_rate / 60.0, self.recipient_burst)
+            self._buckets[key] = bucket
+        return bucket
+
+    # blocks until every bucket has a token for us, returns False if the message should be dropped
+    def acquire(self, keys, priority=PRIORITY_NORMAL):
+        reserve = self.reserve if priority == PRIORITY_LOW else 0
+        deadline = time.time() + (self.low_wait if priority == PRIORITY_LOW else self.max_wait)
+
+        with self._lock:
+            while True:
+                now = time.time()
+                buckets = [self._bucket(key) for key in keys]
+                for bucket in buckets:
+                    bucket.refill(now)
+                wait = max(bucket.wait_time(now, reserve) for bucket in buckets)
+
+                if wait <= 0:
+                    for bucket in buckets:
+                        bucket.tokens -= 1
+                    self._granted += 1
+                    return True
+
+                if now + wait > deadline:
+                    self._dropped += 1
+                    self._logger.warning("RateLimiter: dropping [{}] priority message, budget exhausted for [{:.1f}s]".format(PRIORITY_NAMES.get(priority), wait))
+                    return False
+
+                self._logger.debug("RateLimiter: deferring [{}] priority message for [{:.1f}s]".format(PRIORITY_NAMES.get(priority), wait))
+                self._changed.wait(min(wait, deadline - now))
+
+    def rate_limited(self, keys):
+        with self._lock:
+            self._limited += 1
+            now = time.time()
+            for key in keys:
+                bucket = self._bucket(key)
+                bucket.penalty = min(self.max_cooldown, bucket.penalty * 2 if bucket.penalty else self.cooldown)
+                bucket.tokens = 0
+                bucket.updated = now
+                bucket.blocked_until = now + bucket.penalty
+            self._logger.warning("RateLimiter: rate limited by signal, backing off for [{}s]".format(max(self._bucket(key).penalty for key in keys)))
+
+    def succeeded(self, keys):
+        with self._lock:
+            for key in keys:
+                bucket = self._buckets.get(key)
+                if bucket: bucket.penalty = 0
+
+    def configure(self, sender_rate, sender_burst, recipient_rate, recipient_burst, reserve, low_wait):
+        with self._lock:
+            self.sender_rate = sender_rate
+            self.sender_burst = sender_burst
+            self.recipient_rate = recipient_rate
+            self.recipient_burst = recipient_burst
+            self.reserve = reserve
+            self.low_wait = low_wait
+            # keep running cooldowns, waiting senders pick up the new budget right away
+            for key, bucket in self._buckets.items():
+                if key[0] == "sender":
+                    bucket.rate, bucket.burst = sender_rate / 60.0, sender_burst
+                else:
+                    bucket.rate, bucket.burst = recipient_rate / 60.0, recipient_burst
+                bucket.tokens = min(bucket.tokens, bucket.burst)
+            self._changed.notify_all()
+
+    def stats(self):
+        with self._lock:
+            now = time.time()
+            return dict(
+                granted=self._granted,
+                dropped=self._dropped,
+                rate_limited=self._limited,
+                blocked=sum(1 for bucket in self._buckets.values() if bucket.blocked_until > now)
+            )
@@ -0,0 +1,67 @@
+# coding=utf-8
+from __future__ import absolute_import
+
+import threading
+import time
+import zlib
+
+from .ratelimit import is_rate_limit_error
+
+# how long a sender is skipped after signal rejected it
+RATE_LIMIT_COOLDOWN = 60
+UNREGISTERED_COOLDOWN = 3600
+
+def is_unregistered_error(e):
+    text = str(e).lower()
+    return "not registered" in text or "unregistered" in text or "no such account" in text
+
+# Pool of sender accounts sharing the recipients.
+#
+# Each recipient is mapped to a sender by rendezvous hashing, so the mapping is stable, spreads evenly and
+# only the recipients of a sender that is added or removed move. The same ranking is the failover order:
+# while a sender is cooling down after a rate limit or is not registered, its recipients go through the
+# next sender in their ranking.
+class SenderPool(object):
+    def __init__(self, logger, senders):
+        self._logger = logger
+        self._lock = threading.Lock()
+        self._unavailable = {}
+        self.senders = tuple(senders)
+
+    def ranked(self, key):
+        return sorted(self.senders, key=lambda sender: zlib.crc32((sender + "|" + key).encode("utf-8")) & 0xffffffff, reverse=True)
+
+    def available(self, sender):
+        with self._lock:
+            until = self._unavailable.get(sender)
+            if until is not None and until <= time.time():
+                del self._unavailable[sender]
+                until = None
+            return until is None
+
+    # the preferred sender that is currently usable, or the preferred one if none is
+    def pick(self, key):
+        ranked = self.ranked(key)
+        for sender in ranked:
+            if self.available(sender):
+                return sender
+        return ranked[0]
+
+    # returns True if the error means another sender should be tried
+    def failed(self, sender, error):
+        if is_rate_limit_error(error):
+            cooldown = RATE_LIMIT_COOLDOWN
+        elif is_unregistered_error(error):
+            cooldown = UNREGISTERED_COOLDOWN
+        else:
+            return False
+
+        with self._lock:
+            self._unavailable[sender] = time.time() + cooldown
+        self._logger.warning("SenderPool: skipping sender [{}] for [{}s]: [{}]".format(sender, cooldown, error))
+        return len(self.senders) > 1
+
+    def stats(self):
+        now = time.time()
+        with self._lock:
+            return dict((sender, dict(available=self._unavailable.get(sender, 0) <= now)) for sender in self.senders)
@@ -19,6 +19,19 @@ $(function() {
 		self.testResult(false);
 		self.testSuccessful(false);
 		self.testMessage("");*/
+
+		// templates rejected on save keep their previous value
+		self.onDataUpdaterPluginMessage = function(plugin, data) {
+			if (plugin !== "signalclirestapi" || data.type !== "invalidtemplate") {
+				return;
+			}
+			new PNotify({
+				title: "Signal message template not saved",
+				text: "Kept the previous value of " + data.key + ": " + data.error,
+				type: "error",
+				hide: false
+			});
+		};
     }
 
 	self.testMessage = function(data) {
@@ -0,0 +1,170 @@
+# coding=utf-8
+from __future__ import absolute_import
+
+import collections
+import threading
+import time
+
+try:
+    from urllib.request import urlopen
+except ImportError:
+    from urllib2 import urlopen
+
+MAX_FRAME_SIZE = 8 * 1024 * 1024
+
+class _Fetch(object):
+    def __init__(self):
+        self.done = threading.Event()
+        self.data = None
+        self.error = None
+        self.fetched = None
+
+# Single-flight webcam snapshot source.
+#
+# Concurrent callers for the same url share one in-flight request, and callers arriving within ttl seconds
+# after a successful fetch get the very same image bytes. Errors are handed to everyone waiting on that
+# fetch but are never cached.
+class SnapshotProvider(object):
+    def __init__(self, logger, ttl=2, timeout=10):
+        self._logger = logger
+        self._lock = threading.Lock()
+        self._fetches = {}
+        self.ttl = ttl
+        self.timeout = timeout
+
+    def get(self, url):
+        with self._lock:
+            fetch = self._fetches.get(url)
+            fresh = fetch is not None and (not fetch.done.is_set() or (fetch.error is None and time.time() - fetch.fetched < self.ttl))
+            owner = not fresh
+            if owner:
+                fetch = _Fetch()
+                self._fetches[url] = fetch
+
+        if owner:
+            start = time.time()
+            try:
+                response = urlopen(url, timeout=self.timeout)
+                try:
+                    fetch.data = response.read()
+                finally:
+                    response.close()
+            except Exception as e:
+                fetch.error = e
+            finally:
+                fetch.fetched = time.time()
+                fetch.done.set()
+            self._logger.debug("SnapshotProvider: fetched [{}] bytes in [{:.3f}s]".format(len(fetch.data or b""), fetch.fetched - start))
+        else:
+            self._logger.debug("SnapshotProvider: sharing snapshot")
+            if not fetch.done.wait(self.timeout * 2):
+                raise Exception("Timed out waiting for webcam snapshot")
+
+        if fetch.error is not None:
+            raise fetch.error
+        return fetch.data
+
+# Fixed-memory ring buffer of recent JPEG frames, bounded by age and by total size.
+class FrameBuffer(object):
+    def __init__(self, seconds=10, max_bytes=20 * 1024 * 1024):
+        self._lock = threading.Lock()
+        self._frames = collections.deque()
+        self._bytes = 0
+        self.seconds = seconds
+        self.max_bytes = max_bytes
+
+    def push(self, frame, timestamp=None):
+        timestamp = timestamp or time.time()
+        with self._lock:
+            self._frames.append((timestamp, frame))
+            self._bytes += len(frame)
+            while self._frames and (self._bytes > self.max_bytes or timestamp - self._frames[0][0] > self.seconds):
+                self._bytes -= len(self._frames.popleft()[1])
+
+    def latest(self, max_age):
+        with self._lock:
+            if self._frames and time.time() - self._frames[-1][0] <= max_age:
+                return self._frames[-1][1]
+        return None
+
+    def frames(self, seconds):
+        since = time.time() - seconds
+        with self._lock:
+            return [frame for timestamp, frame in self._frames if timestamp >= since]
+
+    def stats(self):
+        with self._lock:
+            return dict(frames=len(self._frames), bytes=self._bytes)
+
+# Keeps one persistent connection to the MJPEG stream and feeds every n-th frame into a FrameBuffer.
+# Frames are cut out of the multipart stream by their JPEG start/end markers.
+class MjpegCaptureThread(threading.Thread):
+    def __init__(self, logger, url, frame_buffer, fps=5, timeout=10):
+        super(MjpegCaptureThread, self).__init__(name="signalclirestapi-capture")
+        self.daemon = True
+        self._logger = logger
+        self._url = url
+        self._stop_event = threading.Event()
+        self._response = None
+        self.frame_buffer = frame_buffer
+        self.fps = fps
+        self.timeout = timeout
+
+    def stop(self):
+        self._stop_event.set()
+        response = self._response
+        if response:
+            try:
+                response.close()
+            except Exception:
+                pass
+
+    def run(self):
+        while not self._stop_event.is_set():
+            try:
+                self._response = urlopen(self._url, timeout=self.timeout)
+                self._logger.debug("MjpegCaptureThread: connected to [{}]".format(self._url))
+                self._read(self._response)
+            except Exception as e:
+                if not self._stop_event.is_set():
+                    self._logger.warning("MjpegCaptureThread: stream error: [{}]".format(e))
+            finally:
+                if self._response:
+                    try:
+                        self._response.close()
+                    except Exception:
+                        pass
+                    self._response = None
+            self._stop_event.wait(5)
+        self._logger.debug("MjpegCaptureThread: stopped")
+
+    def _read(self, response):
+        interval = 1.0 / max(0.1, float(self.fps))
+        last = 0
+        data = b""
+        read = getattr(response, "read1", response.read)
+        while not self._stop_event.is_set():
+            chunk = read(16 * 1024)
+            if not chunk:
+                raise Exception("stream closed")
+            data += chunk
+
+            while True:
+                start = data.find(b"\xff\xd8")
+                if start < 0:
+                    data = data[-1:]
+                    break
+                end = data.find(b"\xff\xd9", start + 2)
+                if end < 0:
+                    data = data[start:]
+                    # drop a runaway frame rather than growing without bound
+                    if len(data) > MAX_FRAME_SIZE:
+                        data = b""
+                    break
+
+                frame = data[start:end + 2]
+                data = data[end + 2:]
+                now = time.time()
+                if now - last >= interval:
+                    last = now
+                    self.frame_buffer.push(frame, now)